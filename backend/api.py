@@ -1,48 +1,147 @@
 import datetime
+import hashlib
 import json
 import os
+import threading
 import uuid
 from collections import defaultdict
 
-import boto3
-from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
-from cryptography.fernet import Fernet
+import click
+from cryptography.fernet import Fernet, InvalidToken
 from dotenv import load_dotenv
-from flask import Flask, jsonify, make_response, request
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
 from flask_restful import Api, Resource, fields, marshal_with, reqparse
-from langchain import OpenAI
-from langchain.chains.summarize import load_summarize_chain
-from langchain.docstore.document import Document as docstore_Document
+from sqlalchemy import exists, func, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
 
-from model import Collegue, Complaints, Document, Documentrequest, Ticket, User, db
+from model import (
+    Collegue,
+    ComplaintRollup,
+    Complaints,
+    Document,
+    Documentrequest,
+    Ticket,
+    User,
+    db,
+)
+from services.blind_index import blind_index, configure_blind_index_key
+from services.blobs import (
+    abandon_blob,
+    document_key,
+    release_blob,
+    store_blob,
+    sweep_blobs,
+)
+from services.cache import PayloadCache
+from services.clients import CLIENTS, sqlalchemy_engine_options
+from services.jobs import JobQueue, JobQueueFull
+from services.keyring import (
+    KeyringError,
+    add_key,
+    load_keyring,
+    promote_key,
+    read_keyring,
+    retire_keys,
+)
+from services.metrics import REGISTRY, TimedCipher, instrument_app
+from services.migrations import (
+    TIMESTAMP_COLUMNS,
+    add_missing_columns,
+    backfill_ticket_created_at,
+    convert_timestamp_column,
+    create_missing_indexes,
+    drop_removed_columns,
+)
+from services.pagination import (
+    DEFAULT_PAGE_SIZE,
+    InvalidCursor,
+    keyset_page,
+    page_size,
+)
+from services.presign import PresignedUrls
+from services.reencrypt import ReencryptionProgress, reencrypt_complaints
+from services.resource_cache import ResourceCache
+from services.rollups import UNKNOWN_CATEGORY, bump_rollup, move_rollup, rebuild_rollups
+from services.storage import StorageError
+from services.summaries import current_summary, summarize_chat
+from services.tickets import (
+    TICKET_STATUSES,
+    allowed_sources,
+    allowed_targets,
+    transition_tickets,
+)
 
 load_dotenv()
 
 app = Flask(__name__)
+app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv(
+    "DATABASE_URL", "sqlite:///digital_box.db"
+)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlalchemy_engine_options(
+    app.config["SQLALCHEMY_DATABASE_URI"]
+)
+db.init_app(app)
 api = Api(app)
+instrument_app(
+    app, "api", slow_request_ms=float(os.getenv("SLOW_REQUEST_MS", 0)) or None
+)
+
+# AWS clients and the summarize chain are built by the first request that
+# needs them rather than at import
+blob_store = CLIENTS.lazy("blob_store")
+message_store = CLIENTS.lazy("message_store")
+REGISTRY.register_collector("digital_box_clients", CLIENTS.stats)
+
+summary_jobs = JobQueue(
+    max_workers=int(os.getenv("SUMMARY_WORKERS", 2)),
+    max_queued=int(os.getenv("SUMMARY_QUEUE", 16)),
+)
+REGISTRY.register_collector("digital_box_summary_jobs", summary_jobs.stats)
+# A failed summary is reported instead of being retried for this long
+SUMMARY_RETRY_SECONDS = int(os.getenv("SUMMARY_RETRY_SECONDS", 30))
 
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+# Complaints record the id of the key that encrypted them in encryption_key;
+# never the key itself
+KEYRING_PATH = os.getenv("ENCRYPTION_KEYRING", "keyring.json")
+KEYRING = load_keyring(
+    KEYRING_PATH, create=os.getenv("ENCRYPTION_KEYRING_CREATE") == "1"
 )
-BUCKET_NAME = os.getenv("BUCKET_NAME")
+CIPHER_SUITE = TimedCipher(KEYRING.cipher)
+configure_blind_index_key(KEYRING.blind_index_key)
+
+reencryption_jobs = JobQueue(max_workers=1, max_queued=0)
+REENCRYPTION = ReencryptionProgress()
+REGISTRY.register_collector("digital_box_reencryption", REENCRYPTION.stats)
 
-dynamodb = boto3.resource(
-    "dynamodb",
-    region_name=os.getenv("AWS_REGION"),
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+COMPLAINT_CACHE = PayloadCache(
+    max_bytes=int(os.getenv("COMPLAINT_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+    ttl_seconds=int(os.getenv("COMPLAINT_CACHE_TTL_SECONDS", 900)),
 )
-chat_table = dynamodb.Table(os.getenv("CHAT_TABLE"))
+REGISTRY.register_collector("digital_box_complaint_cache", COMPLAINT_CACHE.stats)
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-llm = OpenAI(openai_api_key=openai_api_key)
-summarize_chain = load_summarize_chain(llm, chain_type="map_reduce")
+# Serialized ticket and complaint lookups. Writes through this process
+# invalidate their entry; other API processes may serve a ticket status up to
+# the TTL old.
+RESOURCE_CACHE = ResourceCache(
+    max_bytes=int(os.getenv("RESOURCE_CACHE_MAX_BYTES", 8 * 1024 * 1024)),
+    ttl_seconds=int(os.getenv("RESOURCE_CACHE_TTL_SECONDS", 30)),
+)
+REGISTRY.register_collector("digital_box_resource_cache", RESOURCE_CACHE.stats)
 
-KEY = Fernet.generate_key()
-CIPHER_SUITE = Fernet(KEY)
+PRESIGNED_URLS = PresignedUrls(
+    blob_store,
+    expires_in=int(os.getenv("PRESIGNED_URL_EXPIRES_SECONDS", 3600)),
+    refresh_margin=int(os.getenv("PRESIGNED_URL_REFRESH_MARGIN_SECONDS", 300)),
+)
+REGISTRY.register_collector("digital_box_presigned_url_cache", PRESIGNED_URLS.stats)
 
 # ==============================output fields========================================
 complaint_fields = {
@@ -111,6 +210,46 @@ update_ticket_parser = reqparse.RequestParser()
 update_ticket_parser.add_argument(
     "ticket_status", type=str, required=True, help="Ticket status is required"
 )
+update_ticket_parser.add_argument("version", type=int, help="version must be an integer")
+
+page_parser = reqparse.RequestParser()
+page_parser.add_argument(
+    "limit", type=page_size, location="args", help="limit must be a positive integer"
+)
+page_parser.add_argument("after", type=str, location="args")
+
+batch_document_requests_parser = reqparse.RequestParser()
+batch_document_requests_parser.add_argument(
+    "user_ids", type=str, action="append", location="json", default=[]
+)
+batch_document_requests_parser.add_argument(
+    "colleague_ids", type=str, action="append", location="json", default=[]
+)
+
+complaint_filter_parser = reqparse.RequestParser()
+complaint_filter_parser.add_argument("category", type=str, location="args")
+complaint_filter_parser.add_argument("title", type=str, location="args")
+
+list_complaints_parser = complaint_filter_parser.copy()
+list_complaints_parser.add_argument(
+    "limit", type=page_size, location="args", help="limit must be a positive integer"
+)
+list_complaints_parser.add_argument("after", type=str, location="args")
+
+export_complaints_parser = complaint_filter_parser.copy()
+export_complaints_parser.add_argument(
+    "since",
+    type=datetime.datetime.fromisoformat,
+    location="args",
+    help="since must be an ISO 8601 date",
+)
+export_complaints_parser.add_argument(
+    "until",
+    type=datetime.datetime.fromisoformat,
+    location="args",
+    help="until must be an ISO 8601 date",
+)
+export_complaints_parser.add_argument("status", type=str, location="args")
 
 # ==============================Resource classes========================================
 
@@ -127,6 +266,233 @@ def generate_ticket_id(complaint_id, user_id):
     return ticket_id
 
 
+MAX_BATCH_IDS = 100
+EXPORT_CHUNK_SIZE = 1000
+BULK_CHUNK_SIZE = 500
+MAX_BULK_TICKETS = 500
+COMPLAINT_FIELDS = ("title", "description", "category", "user_id")
+
+
+def paged_response(items, next_cursor):
+    response = make_response(jsonify(items), 200)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+def document_request_fulfilled():
+    return exists().where(Document.document_request_id == Documentrequest.request_id)
+
+
+def document_request_data(document_request):
+    return {
+        "request_id": document_request.request_id,
+        "user_id": document_request.user_id,
+        "document_type": document_request.document_type,
+        "requested_at": document_request.requested_at.isoformat(),
+        "colleague_id": document_request.colleague_id,
+        "document_purpose": document_request.document_purpose,
+        "requested_dpt": document_request.requested_dpt,
+    }
+
+
+def filter_complaints(query, args):
+    # Equality filters on encrypted fields resolve against their blind indexes
+    if args.get("category"):
+        query = query.filter(
+            Complaints.category_blind_index == blind_index("category", args["category"])
+        )
+    if args.get("title"):
+        query = query.filter(
+            Complaints.title_blind_index == blind_index("title", args["title"])
+        )
+    return query
+
+
+def complaint_cache_key(complaint_id, encrypted_data):
+    # Payloads are immutable once written; keying on a digest of the ciphertext
+    # keeps the entry correct if a row is ever re-encrypted.
+    digest = hashlib.blake2b(encrypted_data.encode(), digest_size=16).hexdigest()
+    return (complaint_id, digest)
+
+
+def decrypt_complaint(complaint, use_cache=True):
+    cache_key = complaint_cache_key(complaint.complaint_id, complaint.encrypted_data)
+    complaint_data = COMPLAINT_CACHE.get(cache_key) if use_cache else None
+    if complaint_data is None:
+        decrypted_data = CIPHER_SUITE.decrypt(complaint.encrypted_data.encode())
+        complaint_data = json.loads(decrypted_data)
+        if use_cache:
+            COMPLAINT_CACHE.put(cache_key, complaint_data, len(decrypted_data))
+    return complaint_data
+
+
+def rollup_category(complaint, use_cache=True):
+    # A complaint that no longer decrypts still has a ticket whose status can
+    # change, so its rollup counts move in the "unknown" bucket
+    try:
+        return decrypt_complaint(complaint, use_cache)["category"]
+    except InvalidToken:
+        return UNKNOWN_CATEGORY
+
+
+def iter_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def parse_bulk_complaint(item):
+    # Returns (payload, created_at, error) for one item of a bulk upload
+    if not isinstance(item, dict):
+        return None, None, "Invalid complaint"
+    for field in COMPLAINT_FIELDS:
+        if not isinstance(item.get(field), str) or not item[field]:
+            return None, None, f"{field} is required"
+    created_at = datetime.datetime.now()
+    if item.get("created_at") is not None:
+        try:
+            created_at = datetime.datetime.fromisoformat(item["created_at"])
+        except (TypeError, ValueError):
+            return None, None, "created_at must be an ISO 8601 date"
+    return {field: item[field] for field in COMPLAINT_FIELDS}, created_at, None
+
+
+def insert_complaint_chunk(chunk):
+    # Stores a chunk of (index, item) pairs in one transaction and returns a
+    # result per item
+    results = []
+    valid = []
+    for index, item in chunk:
+        payload, created_at, error = parse_bulk_complaint(item)
+        if error:
+            results.append({"index": index, "error": error})
+        else:
+            valid.append((index, payload, created_at))
+    known_users = {
+        user_id
+        for (user_id,) in db.session.query(User.id).filter(
+            User.id.in_({payload["user_id"] for _, payload, _ in valid})
+        )
+    }
+    complaint_rows = []
+    ticket_rows = []
+    rollups = defaultdict(int)
+    stored = []
+    for index, payload, created_at in valid:
+        user_id = payload["user_id"]
+        if user_id not in known_users:
+            results.append({"index": index, "error": "User not found"})
+            continue
+        complaint_id = generate_unique_complaint_id()
+        ticket_id = generate_ticket_id(complaint_id, user_id)
+        complaint_rows.append(
+            {
+                "complaint_id": complaint_id,
+                "encrypted_data": CIPHER_SUITE.encrypt(
+                    json.dumps(payload).encode()
+                ).decode(),
+                "encryption_key": KEYRING.primary_id,
+                "category_blind_index": blind_index("category", payload["category"]),
+                "title_blind_index": blind_index("title", payload["title"]),
+                "user_id": user_id,
+                "created_at": created_at,
+            }
+        )
+        ticket_rows.append(
+            {
+                "ticket_id": ticket_id,
+                "ticket_status": "open",
+                "complaint_id": complaint_id,
+                "user_id": user_id,
+                "created_at": created_at,
+            }
+        )
+        rollups[(created_at.date(), payload["category"])] += 1
+        stored.append({"index": index, "complaint_id": complaint_id, "ticket_id": ticket_id})
+    if complaint_rows:
+        try:
+            db.session.execute(insert(Complaints), complaint_rows)
+            db.session.execute(insert(Ticket), ticket_rows)
+            for (day, category), count in rollups.items():
+                bump_rollup(day, category, "open", count)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception("Bulk complaint insert failed")
+            stored = [
+                {"index": result["index"], "error": "Failed to store complaint"}
+                for result in stored
+            ]
+    return results + stored
+
+
+def ticket_conflict(ticket):
+    return make_response(
+        jsonify(
+            {
+                "message": "Ticket was modified by someone else",
+                "ticket_status": ticket.ticket_status,
+                "version": ticket.version,
+            }
+        ),
+        409,
+    )
+
+
+def invalid_transition(ticket, ticket_status):
+    return make_response(
+        jsonify(
+            {
+                "message": f"Cannot move a ticket from {ticket.ticket_status} to {ticket_status}",
+                "ticket_status": ticket.ticket_status,
+                "version": ticket.version,
+            }
+        ),
+        409,
+    )
+
+
+def cached_resource(key, load, not_found_message):
+    # Polling clients that send back the ETag get a bodyless 304 while the
+    # resource is unchanged
+    cached = RESOURCE_CACHE.get(key, load)
+    if cached is None:
+        return make_response(jsonify({"message": not_found_message}), 404)
+    body, etag = cached
+    if request.if_none_match.contains(etag):
+        RESOURCE_CACHE.record_not_modified()
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Caches may keep the body but must revalidate before each reuse
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def parse_ticket_transitions(data):
+    # Returns ({ticket_id: expected version or None}, error)
+    if not isinstance(data, dict) or not isinstance(data.get("tickets"), list):
+        return None, "tickets must be a list"
+    if len(data["tickets"]) > MAX_BULK_TICKETS:
+        return None, f"At most {MAX_BULK_TICKETS} tickets per request"
+    requested = {}
+    for item in data["tickets"]:
+        if isinstance(item, str):
+            requested[item] = None
+        elif (
+            isinstance(item, dict)
+            and isinstance(item.get("ticket_id"), str)
+            and (item.get("version") is None or type(item["version"]) is int)
+        ):
+            requested[item["ticket_id"]] = item.get("version")
+        else:
+            return None, "Each ticket must be an id or an object with ticket_id and version"
+    return requested, None
+
+
 class EncryptionResource(Resource):
     def post(self):
         data = request.get_json()
@@ -162,18 +528,18 @@ class UserResource(Resource):
         user = User.query.filter_by(id=user_id).first()
         if not user:
             return make_response(jsonify({"message": "User not found"}), 404)
-        complaints = Complaints.query.filter_by(user_id=user_id).all()
-        complaints = sorted(complaints, key=lambda x: x.created_at, reverse=True)
+        args = complaint_filter_parser.parse_args()
+        complaints = (
+            filter_complaints(Complaints.query.filter_by(user_id=user_id), args)
+            .order_by(Complaints.created_at.desc())
+            .all()
+        )
         return make_response(
             jsonify(
                 [
                     {
                         "complaint_id": complaint.complaint_id,
-                        "complaint_data": json.loads(
-                            CIPHER_SUITE.decrypt(
-                                complaint.encrypted_data.encode()
-                            ).decode()
-                        ),
+                        "complaint_data": decrypt_complaint(complaint),
                         "user_id": complaint.user_id,
                         "created_at": complaint.created_at.isoformat(),
                         "ticketID": complaint.ticket.ticket_id,
@@ -203,22 +569,28 @@ class CollegueResource(Resource):
         collegue = Collegue.query.filter_by(id=collegue_id).first()
         if not collegue:
             return make_response(jsonify({"message": "Collegue not found"}), 404)
-        document_requests = Documentrequest.query.filter_by(
-            collegue_id=collegue_id
-        ).all()
-        return make_response(
-            jsonify(
-                [
-                    {
-                        "request_id": document_request.request_id,
-                        "user_id": document_request.user_id,
-                        "document_type": document_request.document_type,
-                        "requested_at": document_request.requested_at.isoformat(),
-                    }
-                    for document_request in document_requests
-                ]
-            ),
-            200,
+        args = page_parser.parse_args()
+        try:
+            document_requests, next_cursor = keyset_page(
+                Documentrequest.query.filter_by(colleague_id=collegue_id),
+                [Documentrequest.requested_at, Documentrequest.request_id],
+                key=lambda row: [row.requested_at, row.request_id],
+                after=args.get("after"),
+                limit=args.get("limit") or DEFAULT_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            return make_response(jsonify({"message": "Invalid cursor"}), 400)
+        return paged_response(
+            [
+                {
+                    "request_id": document_request.request_id,
+                    "user_id": document_request.user_id,
+                    "document_type": document_request.document_type,
+                    "requested_at": document_request.requested_at.isoformat(),
+                }
+                for document_request in document_requests
+            ],
+            next_cursor,
         )
 
 
@@ -233,91 +605,126 @@ class ComplaintResource(Resource):
         complaint = Complaints(
             complaint_id=complaint_id,
             encrypted_data=encrypted_data,
+            encryption_key=KEYRING.primary_id,
+            category_blind_index=blind_index("category", args.get("category")),
+            title_blind_index=blind_index("title", args.get("title")),
             user_id=user_id,
             created_at=created_at,
         )
         db.session.add(complaint)
-        db.session.commit()
         ticket_id = generate_ticket_id(complaint_id, user_id)
         ticket = Ticket(
             ticket_id=ticket_id,
             ticket_status="open",
             complaint_id=complaint_id,
             user_id=user_id,
+            created_at=created_at,
         )
         db.session.add(ticket)
+        bump_rollup(created_at.date(), args.get("category"), "open")
         db.session.commit()
+        COMPLAINT_CACHE.put(
+            complaint_cache_key(complaint_id, encrypted_data), dict(args), len(data)
+        )
         return make_response(jsonify({"message": "Complaint created successfully"}), 200)
 
     def get(self, complaint_id):
-        complaint = Complaints.query.filter_by(complaint_id=complaint_id).first()
-        if not complaint:
-            return make_response(jsonify({"message": "Complaint not found"}), 404)
-        decrypted_data = CIPHER_SUITE.decrypt(complaint.encrypted_data.encode()).decode()
-        complaint_data = json.loads(decrypted_data)
-        return make_response(
-            jsonify(
-                {
-                    "complaint_id": complaint.complaint_id,
-                    "complaint_data": complaint_data,
-                    "user_id": complaint.user_id,
-                    "created_at": complaint.created_at.isoformat(),
-                }
-            ),
-            200,
-        )
+        def load():
+            complaint = Complaints.query.filter_by(complaint_id=complaint_id).first()
+            if not complaint:
+                return None
+            return {
+                "complaint_id": complaint.complaint_id,
+                "complaint_data": decrypt_complaint(complaint),
+                "user_id": complaint.user_id,
+                "created_at": complaint.created_at.isoformat(),
+            }
+
+        return cached_resource(("complaint", complaint_id), load, "Complaint not found")
 
 
 class TicketResource(Resource):
     def get(self, ticket_id):
-        ticket = Ticket.query.filter_by(ticket_id=ticket_id).first()
-        if not ticket:
-            return make_response(jsonify({"message": "Ticket not found"}), 404)
-        return make_response(
-            jsonify(
-                {"ticket_id": ticket.ticket_id, "ticket_status": ticket.ticket_status}
-            ),
-            200,
-        )
+        def load():
+            ticket = Ticket.query.filter_by(ticket_id=ticket_id).first()
+            if not ticket:
+                return None
+            return {
+                "ticket_id": ticket.ticket_id,
+                "ticket_status": ticket.ticket_status,
+                "version": ticket.version,
+            }
+
+        return cached_resource(("ticket", ticket_id), load, "Ticket not found")
 
     def put(self, ticket_id):
         ticket = Ticket.query.filter_by(ticket_id=ticket_id).first()
         if not ticket:
             return make_response(jsonify({"message": "Ticket not found"}), 404)
         args = update_ticket_parser.parse_args()
-        ticket_status = args.get("ticket_status")
-        if ticket_status:
+        if args.get("version") is not None and args["version"] != ticket.version:
+            return ticket_conflict(ticket)
+        ticket_status = args["ticket_status"]
+        if ticket_status not in TICKET_STATUSES:
+            return make_response(
+                jsonify({"message": f"Unknown ticket status {ticket_status}"}), 400
+            )
+        if ticket_status != ticket.ticket_status:
+            if ticket_status not in allowed_targets(ticket.ticket_status):
+                return invalid_transition(ticket, ticket_status)
+            complaint = ticket.complaints
+            move_rollup(
+                complaint.created_at.date(),
+                rollup_category(complaint),
+                ticket.ticket_status,
+                ticket_status,
+            )
             ticket.ticket_status = ticket_status
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            return ticket_conflict(Ticket.query.filter_by(ticket_id=ticket_id).first())
+        finally:
+            RESOURCE_CACHE.invalidate(("ticket", ticket_id))
         return make_response(jsonify({"message": "Ticket resolved successfully"}), 200)
 
 
+class TicketTransitionsResource(Resource):
+    def post(self):
+        data = request.get_json(silent=True)
+        ticket_status = data.get("ticket_status") if isinstance(data, dict) else None
+        if ticket_status not in TICKET_STATUSES or not allowed_sources(ticket_status):
+            return make_response(
+                jsonify({"message": f"Cannot transition tickets to {ticket_status}"}), 400
+            )
+        requested, error = parse_ticket_transitions(data)
+        if error:
+            return make_response(jsonify({"message": error}), 400)
+        updated, skipped = transition_tickets(requested, ticket_status, rollup_category)
+        for ticket in updated:
+            RESOURCE_CACHE.invalidate(("ticket", ticket["ticket_id"]))
+        return make_response(jsonify({"updated": updated, "skipped": skipped}), 200)
+
+
 class UserDocumentsResource(Resource):
     def get(self, user_id):
-        req_documents = Documentrequest.query.filter_by(user_id=user_id).all()
-        req_documents = [
-            req_document
-            for req_document in req_documents
-            if not Document.query.filter_by(
-                document_request_id=req_document.request_id
-            ).first()
-        ]
-        return make_response(
-            jsonify(
-                [
-                    {
-                        "request_id": document_request.request_id,
-                        "user_id": document_request.user_id,
-                        "document_type": document_request.document_type,
-                        "requested_at": document_request.requested_at.isoformat(),
-                        "colleague_id": document_request.colleague_id,
-                        "document_purpose": document_request.document_purpose,
-                        "requested_dpt": document_request.requested_dpt,
-                    }
-                    for document_request in req_documents
-                ]
-            ),
-            200,
+        args = page_parser.parse_args()
+        try:
+            req_documents, next_cursor = keyset_page(
+                Documentrequest.query.filter_by(user_id=user_id).filter(
+                    ~document_request_fulfilled()
+                ),
+                [Documentrequest.requested_at, Documentrequest.request_id],
+                key=lambda row: [row.requested_at, row.request_id],
+                after=args.get("after"),
+                limit=args.get("limit") or DEFAULT_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            return make_response(jsonify({"message": "Invalid cursor"}), 400)
+        return paged_response(
+            [document_request_data(document_request) for document_request in req_documents],
+            next_cursor,
         )
 
     def post(self):
@@ -363,12 +770,13 @@ class UserUpladDocumentsResource(Resource):
         file_type = file.content_type
         if file_type not in ["application/pdf", "image/jpeg", "image/png"]:
             return {"error": "Invalid file type"}, 400
+        # Stored under its content digest; identical files share one object
         try:
-            s3.upload_fileobj(file, BUCKET_NAME, filename)
-            presigned_url = s3.generate_presigned_url(
-                "get_object", Params={"Bucket": BUCKET_NAME, "Key": filename}
+            blob_digest, blob_size, uploaded = store_blob(
+                blob_store, file.stream, file_type
             )
-        except ClientError:
+        except StorageError:
+            db.session.rollback()
             return {"error": "Failed to upload file to S3"}, 500
         document_id = str(uuid.uuid4())
         document = Document(
@@ -379,14 +787,39 @@ class UserUpladDocumentsResource(Resource):
             uploaded_at=uploaded_at,
             requested_colleague_id=requested_colleague_id,
             document_request_id=document_request_id,
-            presigned_url=presigned_url,
+            blob_digest=blob_digest,
         )
         db.session.add(document)
-        db.session.commit()
-        return {"message": "File uploaded successfully"}, 200
+        try:
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception("Failed to store document %s", document_id)
+            if uploaded:
+                abandon_blob(blob_digest, blob_size, file_type)
+            return {"error": "Failed to store document"}, 500
+        return {
+            "message": "File uploaded successfully",
+            "document_id": document_id,
+            "deduplicated": not uploaded,
+        }, 200
 
     def get(self, id):
-        documents = Document.query.filter_by(requested_colleague_id=id).all()
+        args = page_parser.parse_args()
+        try:
+            documents, next_cursor = keyset_page(
+                Document.query.filter_by(requested_colleague_id=id),
+                [Document.uploaded_at, Document.document_id],
+                key=lambda row: [row.uploaded_at, row.document_id],
+                after=args.get("after"),
+                limit=args.get("limit") or DEFAULT_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            return make_response(jsonify({"message": "Invalid cursor"}), 400)
+        try:
+            urls = PRESIGNED_URLS.urls_for(document_key(document) for document in documents)
+        except StorageError:
+            return {"error": "Failed to sign document URLs"}, 500
         documents_data = [
             {
                 "document_id": document.document_id,
@@ -396,97 +829,218 @@ class UserUpladDocumentsResource(Resource):
                 "uploaded_at": document.uploaded_at.isoformat(),
                 "requested_colleague_id": document.requested_colleague_id,
                 "document_request_id": document.document_request_id,
-                "presigned_url": document.presigned_url,
+                "presigned_url": urls[document_key(document)],
             }
             for document in documents
         ]
-        return documents_data, 200
+        return paged_response(documents_data, next_cursor)
+
+
+class DocumentResource(Resource):
+    def delete(self, document_id):
+        document = Document.query.filter_by(document_id=document_id).first()
+        if not document:
+            return make_response(jsonify({"message": "Document not found"}), 404)
+        db.session.delete(document)
+        if document.blob_digest:
+            release_blob(document.blob_digest)
+        db.session.commit()
+        return make_response(jsonify({"message": "Document deleted successfully"}), 200)
+
+
+class DocumentRequestsBatchResource(Resource):
+    def post(self):
+        args = batch_document_requests_parser.parse_args()
+        user_ids = set(args.get("user_ids") or [])
+        colleague_ids = set(args.get("colleague_ids") or [])
+        if len(user_ids) + len(colleague_ids) > MAX_BATCH_IDS:
+            return make_response(
+                jsonify({"message": f"At most {MAX_BATCH_IDS} ids per batch"}), 400
+            )
+        results = {
+            "users": {
+                user_id: {"pending": [], "fulfilled": []} for user_id in user_ids
+            },
+            "colleagues": {
+                colleague_id: {"pending": [], "fulfilled": []}
+                for colleague_id in colleague_ids
+            },
+        }
+        if not user_ids and not colleague_ids:
+            return results, 200
+        rows = (
+            db.session.query(
+                Documentrequest, document_request_fulfilled().label("fulfilled")
+            )
+            .filter(
+                Documentrequest.user_id.in_(user_ids)
+                | Documentrequest.colleague_id.in_(colleague_ids)
+            )
+            .order_by(Documentrequest.requested_at.desc(), Documentrequest.request_id)
+            .all()
+        )
+        for document_request, fulfilled in rows:
+            state = "fulfilled" if fulfilled else "pending"
+            data = document_request_data(document_request)
+            if document_request.user_id in user_ids:
+                results["users"][document_request.user_id][state].append(data)
+            if document_request.colleague_id in colleague_ids:
+                results["colleagues"][document_request.colleague_id][state].append(data)
+        return results, 200
 
 
 class AllComplaints(Resource):
     def get(self):
-        complaints = Complaints.query.all()
-        complaints = [
-            complaint
-            for complaint in complaints
-            if complaint.ticket.ticket_status == "open"
-        ]
-        complaints = sorted(complaints, key=lambda x: x.created_at, reverse=True)
-        return make_response(
-            jsonify(
-                [
-                    {
-"complaint_id": complaint.complaint_id,
-                        "complaint_data": json.loads(
-                            CIPHER_SUITE.decrypt(
-                                complaint.encrypted_data.encode()
-                            ).decode()
-                        ),
-                        "user_id": complaint.user_id,
-                        "created_at": complaint.created_at.isoformat(),
-                        "ticketID": complaint.ticket.ticket_id,
-                        "ticket_status": complaint.ticket.ticket_status,
-                    }
-                    for complaint in complaints
-                ]
-            ),
-            200,
+        args = list_complaints_parser.parse_args()
+        query = db.session.query(Complaints, Ticket).join(
+            Ticket, Ticket.complaint_id == Complaints.complaint_id
+        ).filter(Ticket.ticket_status == "open")
+        query = filter_complaints(query, args)
+        try:
+            rows, next_cursor = keyset_page(
+                query,
+                [Ticket.created_at, Ticket.complaint_id],
+                key=lambda row: [row[1].created_at, row[1].complaint_id],
+                after=args.get("after"),
+                limit=args.get("limit") or DEFAULT_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            return make_response(jsonify({"message": "Invalid cursor"}), 400)
+        return paged_response(
+            [
+                {
+                    "complaint_id": complaint.complaint_id,
+                    "complaint_data": decrypt_complaint(complaint),
+                    "user_id": complaint.user_id,
+                    "created_at": complaint.created_at.isoformat(),
+                    "ticketID": ticket.ticket_id,
+                    "ticket_status": ticket.ticket_status,
+                }
+                for complaint, ticket in rows
+            ],
+            next_cursor,
         )
 
 
-dynamodb = boto3.resource(
-    "dynamodb",
-    region_name=os.getenv("AWS_REGION"),
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-)
-chat_table = dynamodb.Table(os.getenv("CHAT_TABLE"))
-
-openai_api_key = os.getenv("OPENAI_API_KEY")
-llm = OpenAI(openai_api_key=openai_api_key)
-summarize_chain = load_summarize_chain(llm, chain_type="map_reduce")
+def run_summary_job(complaint_id):
+    with app.app_context():
+        chain = CLIENTS.get("summarize_chain")
+        return summarize_chat(chain, message_store, complaint_id)
 
 
 class ChatSummaryResource(Resource):
     def get(self, complaint_id):
-        response = chat_table.query(
-            IndexName="complaint_id-message_id-index",
-            KeyConditionExpression=Key("complaint_id").eq(complaint_id),
-            ScanIndexForward=True,
+        summary = current_summary(message_store, complaint_id)
+        if summary is not None:
+            return {"summary": summary}, 200
+        failed = summary_jobs.recent_failure(complaint_id, SUMMARY_RETRY_SECONDS)
+        if failed:
+            response = make_response(
+                jsonify({"message": "Summary failed", "error": failed.error}), 502
+            )
+            response.headers["Retry-After"] = str(SUMMARY_RETRY_SECONDS)
+            return response
+        try:
+            job = summary_jobs.submit(complaint_id, run_summary_job, complaint_id)
+        except JobQueueFull:
+            response = make_response(
+                jsonify({"message": "Too many summaries in progress"}), 429
+            )
+            response.headers["Retry-After"] = "5"
+            return response
+        response = make_response(
+            jsonify({"job_id": job.job_id, "status": job.status}), 202
+        )
+        # Polled by complaint rather than by job: the summary is stored once it
+        # is ready, so any API process can answer, while jobs live in the
+        # process that accepted them
+        response.headers["Location"] = f"/summarize/{complaint_id}"
+        return response
+
+
+class SummaryJobResource(Resource):
+    def get(self, job_id=None):
+        if job_id is None:
+            return summary_jobs.stats(), 200
+        job = summary_jobs.get(job_id)
+        if not job:
+            return make_response(jsonify({"message": "Job not found"}), 404)
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "summary": job.result,
+            "error": job.error,
+        }, 200
+
+
+def run_reencryption_job():
+    with app.app_context():
+        # Reads the keyring again to pick up a key promoted since start-up
+        keyring = read_keyring(KEYRING_PATH)
+        if keyring.primary_id not in KEYRING.keys:
+            error = "Restart the API to load the new primary key first"
+            REENCRYPTION.finish("failed", error=error)
+            raise KeyringError(error)
+        return reencrypt_complaints(
+            keyring,
+            REENCRYPTION,
+            batch_size=int(os.getenv("REENCRYPT_BATCH_SIZE", 200)),
+            rows_per_second=float(os.getenv("REENCRYPT_ROWS_PER_SECOND", 500)),
+        )
+
+
+class KeyringResource(Resource):
+    def get(self):
+        complaints_by_key = (
+            db.session.query(Complaints.encryption_key, func.count())
+            .group_by(Complaints.encryption_key)
+            .all()
+        )
+        return {
+            "primary": KEYRING.primary_id,
+            "keys": KEYRING.key_ids(),
+            "complaints_by_key": {
+                kid or "unknown": count for kid, count in complaints_by_key
+            },
+            "reencryption": REENCRYPTION.stats(),
+            "jobs": reencryption_jobs.stats(),
+        }, 200
+
+
+class KeyringReencryptResource(Resource):
+    def post(self):
+        # Starting a run while one is in progress returns the running job
+        job = reencryption_jobs.submit("reencrypt", run_reencryption_job)
+        response = make_response(
+            jsonify({"job_id": job.job_id, "status": job.status}), 202
         )
-        messages = response["Items"]
-        message_texts = [message["message"] for message in messages]
-        documents = [docstore_Document(page_content=text) for text in message_texts]
-        summary = summarize_chain.run(documents)
-        return {"summary": summary}, 200
+        response.headers["Location"] = "/keyring"
+        return response
 
 
 class ComplaintsAnalytics(Resource):
     def get(self):
-        complaints = db.session.query(Complaints, Ticket).filter(
-            Complaints.complaint_id == Ticket.complaint_id
-        ).all()
-        complaints_last_week = [
-            complaint
-            for complaint, ticket in complaints
-            if ticket.ticket_status == "open"
-            and datetime.datetime.fromisoformat(complaint.created_at)
-            >= (datetime.datetime.now() - datetime.timedelta(days=7))
-        ]
+        since = datetime.date.today() - datetime.timedelta(days=6)
+        rollups = (
+            db.session.query(
+                ComplaintRollup.day,
+                ComplaintRollup.category,
+                func.sum(ComplaintRollup.count),
+            )
+            .filter(
+                ComplaintRollup.day >= since, ComplaintRollup.ticket_status == "open"
+            )
+            .group_by(ComplaintRollup.day, ComplaintRollup.category)
+            .all()
+        )
         queries_last_week = defaultdict(int)
-        for complaint in complaints_last_week:
-            day_of_week = datetime.datetime.fromisoformat(
-                complaint.created_at
-            ).strftime("%a")
-            queries_last_week[day_of_week] += 1
         complaint_domains = defaultdict(int)
-        total_complaints = len(complaints_last_week)
-        for complaint in complaints_last_week:
-            complaint_data = json.loads(
-                CIPHER_SUITE.decrypt(complaint.encrypted_data.encode()).decode()
-            )
-            complaint_domain = complaint_data["category"]
-            complaint_domains[complaint_domain] += 1
+        for day, category, count in rollups:
+            if count <= 0:
+                continue
+            queries_last_week[day.strftime("%a")] += count
+            complaint_domains[category] += count
+        total_complaints = sum(complaint_domains.values())
         complaint_domain_percentages = {
             domain: count / total_complaints for domain, count in complaint_domains.items()
         }
@@ -501,20 +1055,259 @@ class ComplaintsAnalytics(Resource):
         )
 
 
+class ComplaintsExport(Resource):
+    def get(self):
+        args = export_complaints_parser.parse_args()
+        query = db.session.query(Complaints, Ticket).join(
+            Ticket, Ticket.complaint_id == Complaints.complaint_id
+        )
+        query = filter_complaints(query, args)
+        if args.get("status"):
+            query = query.filter(Ticket.ticket_status == args["status"])
+        if args.get("since"):
+            query = query.filter(Complaints.created_at >= args["since"])
+        if args.get("until"):
+            query = query.filter(Complaints.created_at < args["until"])
+        query = query.order_by(
+            Complaints.created_at, Complaints.complaint_id
+        ).yield_per(EXPORT_CHUNK_SIZE)
+
+        def generate():
+            # Headers are already sent once the first row is out, so a row
+            # that cannot be decrypted becomes a marker record instead of
+            # cutting the stream short
+            for complaint, ticket in query:
+                record = {
+                    "complaint_id": complaint.complaint_id,
+                    "user_id": complaint.user_id,
+                    "created_at": complaint.created_at.isoformat(),
+                    "ticketID": ticket.ticket_id,
+                    "ticket_status": ticket.ticket_status,
+                }
+                try:
+                    record["complaint_data"] = decrypt_complaint(
+                        complaint, use_cache=False
+                    )
+                except InvalidToken:
+                    record["error"] = "undecryptable"
+                yield json.dumps(record) + "\n"
+
+        return Response(
+            stream_with_context(generate()), mimetype="application/x-ndjson"
+        )
+
+
+class BulkComplaintsResource(Resource):
+    def post(self):
+        # NDJSON is read line by line so large uploads are never held in
+        # memory at once
+        if request.mimetype == "application/json":
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                return make_response(
+                    jsonify({"message": "Expected a JSON array of complaints"}), 400
+                )
+        elif request.mimetype == "application/x-ndjson":
+            items = iter_ndjson(request.stream)
+        else:
+            return make_response(
+                jsonify({"message": "Expected application/json or application/x-ndjson"}),
+                415,
+            )
+        results = []
+        chunk = []
+        for index, item in enumerate(items):
+            chunk.append((index, item))
+            if len(chunk) == BULK_CHUNK_SIZE:
+                results.extend(insert_complaint_chunk(chunk))
+                chunk = []
+        if chunk:
+            results.extend(insert_complaint_chunk(chunk))
+        results.sort(key=lambda result: result["index"])
+        failed = sum(1 for result in results if "error" in result)
+        return make_response(
+            jsonify(
+                {"created": len(results) - failed, "failed": failed, "results": results}
+            ),
+            200,
+        )
+
+
+class CacheStatsResource(Resource):
+    def get(self):
+        return {
+            "complaint_payloads": COMPLAINT_CACHE.stats(),
+            "presigned_urls": PRESIGNED_URLS.stats(),
+            "resources": RESOURCE_CACHE.stats(),
+        }, 200
+
+
 api.add_resource(EncryptionResource, "/encrypt", "/decrypt")
 api.add_resource(ChatSummaryResource, "/summarize/<string:complaint_id>")
+api.add_resource(SummaryJobResource, "/summary-jobs", "/summary-jobs/<string:job_id>")
 api.add_resource(ComplaintsAnalytics, "/analytics")
 api.add_resource(UserResource, "/user", "/user/<string:user_id>")
 api.add_resource(ComplaintResource, "/complaint", "/complaint/<string:complaint_id>")
 api.add_resource(TicketResource, "/ticket/<string:ticket_id>")
+api.add_resource(TicketTransitionsResource, "/tickets/transitions")
 api.add_resource(CollegueResource, "/collegue", "/collegue/<string:collegue_id>")
 api.add_resource(
     UserDocumentsResource, "/request-document", "/document-requests/<string:user_id>"
 )
+api.add_resource(DocumentRequestsBatchResource, "/document-requests/batch")
+api.add_resource(DocumentResource, "/document/<string:document_id>")
 api.add_resource(
     UserUpladDocumentsResource, "/upload-document", "/upload-document/<string:id>"
 )
 api.add_resource(AllComplaints, "/complaints")
+api.add_resource(ComplaintsExport, "/complaints/export")
+api.add_resource(BulkComplaintsResource, "/complaints/bulk")
+api.add_resource(CacheStatsResource, "/cache/stats")
+api.add_resource(KeyringResource, "/keyring")
+api.add_resource(KeyringReencryptResource, "/keyring/reencrypt")
+
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    rows = rebuild_rollups(
+        lambda complaint: rollup_category(complaint, use_cache=False)
+    )
+    print(f"Rebuilt {rows} complaint rollup rows")
+
+
+@app.cli.command("sweep-blobs")
+@click.option(
+    "--grace-seconds",
+    type=int,
+    default=lambda: int(os.getenv("BLOB_SWEEP_GRACE_SECONDS", 3600)),
+    show_default="BLOB_SWEEP_GRACE_SECONDS or 3600",
+)
+def sweep_blobs_command(grace_seconds):
+    deleted, failed = sweep_blobs(
+        blob_store,
+        grace_seconds,
+        on_error=lambda digest, e: app.logger.exception(
+            "Failed to delete blob %s", digest
+        ),
+    )
+    print(f"Deleted {deleted} unreferenced blobs, {failed} failed")
+
+
+@app.cli.command("backfill-blind-indexes")
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Recompute every index, e.g. after the blind index key changed",
+)
+def backfill_blind_indexes_command(rebuild):
+    # Walks complaint_id order so rows that cannot be decrypted are skipped
+    # and counted instead of being fetched again
+    backfilled = failed = 0
+    after = None
+    while True:
+        query = Complaints.query
+        if not rebuild:
+            query = query.filter(Complaints.category_blind_index.is_(None))
+        if after:
+            query = query.filter(Complaints.complaint_id > after)
+        complaints = query.order_by(Complaints.complaint_id).limit(500).all()
+        if not complaints:
+            break
+        for complaint in complaints:
+            try:
+                complaint_data = decrypt_complaint(complaint, use_cache=False)
+            except InvalidToken:
+                failed += 1
+                continue
+            complaint.category_blind_index = blind_index(
+                "category", complaint_data["category"]
+            )
+            complaint.title_blind_index = blind_index("title", complaint_data["title"])
+            backfilled += 1
+        after = complaints[-1].complaint_id
+        db.session.commit()
+    print(
+        f"Backfilled blind indexes for {backfilled} complaints, "
+        f"{failed} could not be decrypted"
+    )
+
+
+@app.cli.command("migrate-schema")
+@click.option("--batch-size", default=500, show_default=True)
+def migrate_schema_command(batch_size):
+    db.create_all()
+    for dropped in drop_removed_columns():
+        print(f"Dropped column {dropped}")
+    for added in add_missing_columns():
+        print(f"Added column {added}")
+    for table_name, column_name, key_name in TIMESTAMP_COLUMNS:
+        converted = convert_timestamp_column(
+            table_name, column_name, key_name, batch_size=batch_size
+        )
+        print(f"Converted {converted} {table_name}.{column_name} values to DateTime")
+    backfilled = backfill_ticket_created_at(batch_size=batch_size)
+    print(f"Backfilled created_at for {backfilled} tickets")
+    for created in create_missing_indexes():
+        print(f"Created index {created}")
+
+
+@app.cli.command("add-encryption-key")
+@click.option("--primary", is_flag=True, help="encrypt new data with the key at once")
+def add_encryption_key_command(primary):
+    new_id = add_key(KEYRING_PATH, primary=primary)
+    print(f"Added key {new_id}{' as primary' if primary else ''}")
+
+
+@app.cli.command("promote-encryption-key")
+@click.argument("key_id")
+def promote_encryption_key_command(key_id):
+    promote_key(KEYRING_PATH, key_id)
+    print(f"Key {key_id} is now primary; restart the API workers to use it")
+
+
+@app.cli.command("reencrypt-complaints")
+@click.option("--batch-size", default=200, show_default=True)
+@click.option("--rows-per-second", default=500.0, show_default=True)
+@click.option("--after", help="resume after this complaint_id")
+def reencrypt_complaints_command(batch_size, rows_per_second, after):
+    progress = ReencryptionProgress()
+    finished = threading.Event()
+
+    def report():
+        while not finished.wait(5):
+            stats = progress.stats()
+            print(
+                f"{stats['processed']}/{stats['total']} processed, "
+                f"{stats['failed']} failed, last {stats['last_complaint_id']}"
+            )
+
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        stats = reencrypt_complaints(
+            read_keyring(KEYRING_PATH),
+            progress,
+            batch_size=batch_size,
+            rows_per_second=rows_per_second,
+            after=after,
+        )
+    finally:
+        finished.set()
+    print(
+        f"Re-encrypted {stats['reencrypted']} of {stats['total']} complaints, "
+        f"{stats['failed']} could not be decrypted"
+    )
+
+
+@app.cli.command("retire-encryption-keys")
+def retire_encryption_keys_command():
+    in_use = {
+        kid for (kid,) in db.session.query(Complaints.encryption_key).distinct()
+    }
+    if None in in_use:
+        print("Some complaints have no key id; run reencrypt-complaints first")
+        return
+    for retired in retire_keys(KEYRING_PATH, in_use):
+        print(f"Retired key {retired}")
 
 
 if __name__ == "__main__":
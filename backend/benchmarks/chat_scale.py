@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.load import percentile
+
+# Run from backend/: python -m benchmarks.chat_scale --help
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics/rooms", timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def start_cluster(workers, args, workdir):
+    # One relay plus `workers` chat_async.py processes on consecutive ports.
+    # Each worker gets its own local message store, standing in for DynamoDB
+    # so that SQLite's single writer does not cap the cluster.
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "services.pubsub", "--port", str(args.relay_port)],
+            cwd=BACKEND_DIR,
+        )
+    ]
+    ports = [args.base_port + i for i in range(workers)]
+    for port in ports:
+        env = dict(
+            os.environ,
+            CHAT_PORT=str(port),
+            CHAT_MESSAGE_QUEUE=f"relay://127.0.0.1:{args.relay_port}",
+            STORAGE_BACKEND="local",
+            LOCAL_STORAGE_DIR=os.path.join(workdir, f"workers-{workers}", str(port)),
+            CHAT_WRITE_BEHIND="1" if args.write_behind else "0",
+        )
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "chat_async.py"],
+                cwd=BACKEND_DIR,
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+        )
+    try:
+        for port in ports:
+            wait_for_port(port)
+    except OSError:
+        stop_cluster(processes)
+        raise
+    return processes, ports
+
+
+def stop_cluster(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+async def drive_clients(index, ports, args, barrier):
+    import socketio
+
+    loop = asyncio.get_running_loop()
+    received = []
+    latencies = []
+    clients = []
+    # Client g connects to worker g % workers and joins room g % rooms, so every
+    # room has members on every worker
+    numbers = range(index, args.clients, args.client_processes)
+    for number in numbers:
+        client = socketio.AsyncClient(reconnection=False)
+        joined = asyncio.Event()
+        acks = asyncio.Queue()
+        client.on("joined_complaint", lambda data, joined=joined: joined.set())
+        client.on("message_ack", lambda data, acks=acks: acks.put_nowait(json.loads(data)))
+
+        def on_message(data):
+            message = json.loads(data)
+            received.append(message["message_id"])
+            latencies.append(time.time() - json.loads(message["message"])["sent"])
+
+        client.on("receive_message", on_message)
+        await client.connect(
+            f"http://127.0.0.1:{ports[number % len(ports)]}", transports=["websocket"]
+        )
+        await client.emit("join_complaint", f"bench-{number % args.rooms}")
+        await joined.wait()
+        clients.append((number, client, acks))
+
+    await loop.run_in_executor(None, barrier.wait)
+    started = time.time()
+
+    async def send(number, client, acks):
+        stored = 0
+        for i in range(args.messages):
+            await client.emit(
+                "send_message",
+                json.dumps(
+                    {
+                        "complaint_id": f"bench-{number % args.rooms}",
+                        "sender_id": f"client-{number}",
+                        "message": json.dumps({"sent": time.time(), "seq": i}),
+                    }
+                ),
+            )
+            ack = await acks.get()
+            stored += ack["status"] == "stored"
+        return stored
+
+    stored = await asyncio.gather(
+        *[send(*client) for client in clients if client[0] < args.senders]
+    )
+    finished = time.time()
+    # Deliveries relayed from other workers may still be in flight
+    seen = -1
+    while seen != len(received):
+        seen = len(received)
+        await asyncio.sleep(args.settle_seconds)
+    for _, client, _ in clients:
+        await client.disconnect()
+    return {
+        "started": started,
+        "finished": finished,
+        "stored": sum(stored),
+        "received": len(received),
+        "latencies": latencies,
+    }
+
+
+def run_clients(index, ports, args, barrier, results):
+    results.put(asyncio.run(drive_clients(index, ports, args, barrier)))
+
+
+def expected_deliveries(args):
+    members = [0] * args.rooms
+    senders = [0] * args.rooms
+    for number in range(args.clients):
+        members[number % args.rooms] += 1
+        if number < args.senders:
+            senders[number % args.rooms] += 1
+    return sum(m * s * args.messages for m, s in zip(members, senders))
+
+
+def measure(workers, args, workdir):
+    processes, ports = start_cluster(workers, args, workdir)
+    try:
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(args.client_processes)
+        results = context.Queue()
+        drivers = [
+            context.Process(target=run_clients, args=(i, ports, args, barrier, results))
+            for i in range(args.client_processes)
+        ]
+        for driver in drivers:
+            driver.start()
+        runs = [results.get() for _ in drivers]
+        for driver in drivers:
+            driver.join()
+    finally:
+        stop_cluster(processes)
+
+    elapsed = max(run["finished"] for run in runs) - min(run["started"] for run in runs)
+    stored = sum(run["stored"] for run in runs)
+    received = sum(run["received"] for run in runs)
+    latencies = sorted(latency for run in runs for latency in run["latencies"])
+    return {
+        "workers": workers,
+        "messages_sent": args.senders * args.messages,
+        "messages_stored": stored,
+        "messages_per_second": round(stored / elapsed, 1) if elapsed else None,
+        "deliveries_expected": expected_deliveries(args),
+        "deliveries_received": received,
+        "deliveries_per_second": round(received / elapsed, 1) if elapsed else None,
+        "delivery_latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            "p95": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure chat throughput as workers are added behind a message relay"
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=200, help="connected sockets")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--senders", type=int, default=40, help="clients that send")
+    parser.add_argument("--messages", type=int, default=50, help="messages per sender")
+    parser.add_argument("--client-processes", type=int, default=2)
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--settle-seconds", type=float, default=1.0)
+    parser.add_argument("--base-port", type=int, default=5101)
+    parser.add_argument("--relay-port", type=int, default=6390)
+    parser.add_argument("--workdir", help="directory for the workers' local storage")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="digital-box-chat-scale-")
+    report = {
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "workdir", "base_port", "relay_port")
+        },
+        "cpus": os.cpu_count(),
+        "runs": [measure(workers, args, workdir) for workers in args.workers],
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
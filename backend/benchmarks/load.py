@@ -0,0 +1,386 @@
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Run from backend/: python -m benchmarks.load --help
+
+CATEGORIES = ["Payroll", "IT", "HR", "Facilities", "Benefits"]
+ACK_TIMEOUT_SECONDS = 10
+
+
+def configure_environment(workdir, database_url=None):
+    # DATABASE_URL from the shell or .env is deliberately ignored: the seed
+    # step empties the database it runs against
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["LOCAL_STORAGE_DIR"] = os.path.join(workdir, "storage")
+    os.environ["SUMMARY_LLM"] = "extractive"
+    os.environ["ENCRYPTION_KEYRING"] = os.path.join(workdir, "keyring.json")
+    os.environ["ENCRYPTION_KEYRING_CREATE"] = "1"
+    os.environ["DATABASE_URL"] = database_url or (
+        f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    )
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = Counter(str(status) for _, status in samples)
+    errors = sum(
+        count for status, count in statuses.items() if not status.startswith(("2", "3"))
+    )
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "status_codes": dict(statuses),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            "p95": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+    }
+
+
+def run_load(make_client, call, requests, concurrency, seed):
+    # Each worker thread gets its own client and its own random.Random, seeded
+    # from (seed, thread index) since Random is not safe to share between
+    # threads. call(client, i, rng) returns a status.
+    local = threading.local()
+    samples = []
+    lock = threading.Lock()
+    thread_indexes = itertools.count()
+
+    def one(i):
+        client = getattr(local, "client", None)
+        if client is None:
+            with lock:
+                index = next(thread_indexes)
+            local.rng = random.Random(f"{seed}-{index}")
+            client = local.client = make_client()
+        started = time.perf_counter()
+        try:
+            status = call(client, i, local.rng)
+        except Exception as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - started
+        with lock:
+            samples.append((latency, status))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return summarize(samples, time.perf_counter() - started)
+
+
+def seed(api, chat, args):
+    from model import (
+        Collegue,
+        Complaints,
+        Document,
+        Documentrequest,
+        Ticket,
+        User,
+        db,
+    )
+    from services.blind_index import blind_index
+    from services.chat_history import generate_message_id
+    from services.rollups import rebuild_rollups
+
+    rng = random.Random(args.seed)
+    now = datetime.datetime.now()
+    ids = {
+        "users": [],
+        "colleagues": [],
+        "complaints": [],
+        "tickets": [],
+        "requests": [],
+    }
+    with api.app.app_context():
+        if args.database_url:
+            # Never drop tables in a database this script did not create
+            db.create_all()
+            if User.query.first() or Complaints.query.first():
+                sys.exit("The --database-url database is not empty; refusing to seed it")
+        else:
+            db.drop_all()
+            db.create_all()
+        for i in range(args.users):
+            ids["users"].append(f"user-{i}")
+            db.session.add(User(id=f"user-{i}", email=f"user-{i}@example.com"))
+        for i in range(args.colleagues):
+            ids["colleagues"].append(f"colleague-{i}")
+            db.session.add(Collegue(id=f"colleague-{i}", email=f"colleague-{i}@example.com"))
+        db.session.commit()
+        for i in range(args.complaints):
+            user_id = rng.choice(ids["users"])
+            category = rng.choice(CATEGORIES)
+            created_at = now - datetime.timedelta(minutes=rng.randrange(60 * 24 * 14))
+            complaint_id = f"{int(created_at.timestamp())}_{i:08x}"
+            payload = {
+                "title": f"Complaint {i}",
+                "description": "Benchmark complaint " * 8,
+                "category": category,
+                "user_id": user_id,
+            }
+            db.session.add(
+                Complaints(
+                    complaint_id=complaint_id,
+                    encrypted_data=api.CIPHER_SUITE.encrypt(
+                        json.dumps(payload).encode()
+                    ).decode(),
+                    encryption_key=api.KEYRING.primary_id,
+                    category_blind_index=blind_index("category", category),
+                    title_blind_index=blind_index("title", payload["title"]),
+                    user_id=user_id,
+                    created_at=created_at,
+                )
+            )
+            db.session.add(
+                Ticket(
+                    ticket_id=f"{complaint_id}_{user_id}",
+                    ticket_status=rng.choice(["open", "open", "open", "resolved"]),
+                    complaint_id=complaint_id,
+                    user_id=user_id,
+                    created_at=created_at,
+                )
+            )
+            ids["complaints"].append(complaint_id)
+            ids["tickets"].append(f"{complaint_id}_{user_id}")
+            if i % 1000 == 999:
+                db.session.commit()
+        db.session.commit()
+        for i in range(args.document_requests):
+            request_id = f"request-{i}"
+            user_id = rng.choice(ids["users"])
+            colleague_id = rng.choice(ids["colleagues"])
+            requested_at = now - datetime.timedelta(minutes=rng.randrange(60 * 24 * 14))
+            db.session.add(
+                Documentrequest(
+                    request_id=request_id,
+                    user_id=user_id,
+                    document_type="payslip",
+                    colleague_id=colleague_id,
+                    requested_at=requested_at,
+                    document_purpose="benchmark",
+                    requested_dpt="HR",
+                )
+            )
+            if rng.random() < 0.5:
+                db.session.add(
+                    Document(
+                        document_id=f"document-{i}",
+                        user_id=user_id,
+                        document_type="payslip",
+                        filename=f"{request_id}.pdf",
+                        uploaded_at=requested_at + datetime.timedelta(hours=1),
+                        requested_colleague_id=colleague_id,
+                        document_request_id=request_id,
+                    )
+                )
+            ids["requests"].append((request_id, user_id, colleague_id))
+        db.session.commit()
+        rebuild_rollups(lambda complaint: api.decrypt_complaint(complaint)["category"])
+
+    batch = []
+    for i in range(args.messages):
+        batch.append(
+            {
+                "complaint_id": rng.choice(ids["complaints"][: args.chat_complaints]),
+                "message_id": generate_message_id(),
+                "sender_id": rng.choice(ids["users"]),
+                "message": f"Benchmark message {i}",
+                "timestamp": now.isoformat(),
+                "attachment_url": None,
+            }
+        )
+        if len(batch) == 500:
+            chat.message_store.batch_put(batch)
+            batch = []
+    if batch:
+        chat.message_store.batch_put(batch)
+    return ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Seed a local database and measure API and chat latency"
+    )
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--colleagues", type=int, default=20)
+    parser.add_argument("--complaints", type=int, default=5000)
+    parser.add_argument("--document-requests", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--chat-complaints", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument(
+        "--bulk-size", type=int, default=100, help="complaints per bulk ingestion request"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="directory for the database and local storage")
+    parser.add_argument(
+        "--database-url",
+        help="seed this empty database instead of an SQLite file in the workdir",
+    )
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    configure_environment(
+        args.workdir or tempfile.mkdtemp(prefix="digital-box-bench-"), args.database_url
+    )
+    import api
+    import chat
+
+    seed_started = time.perf_counter()
+    ids = seed(api, chat, args)
+    seed_seconds = time.perf_counter() - seed_started
+    chat_complaints = ids["complaints"][: args.chat_complaints]
+
+    def get(path_for):
+        return lambda client, i, rng: client.get(path_for(rng)).status_code
+
+    def poll(path_for):
+        # Revalidates with the ETag from the client's previous poll of the
+        # same resource, as the Flutter client's status polling would
+        etags = {}
+
+        def call(client, i, rng):
+            path = path_for(rng)
+            headers = {"If-None-Match": etags[path]} if path in etags else {}
+            response = client.get(path, headers=headers)
+            if response.headers.get("ETag"):
+                etags[path] = response.headers["ETag"]
+            return response.status_code
+
+        return call
+
+    def upload(client, i, rng):
+        request_id, user_id, colleague_id = rng.choice(ids["requests"])
+        return client.post(
+            "/upload-document",
+            data={
+                "file": (io.BytesIO(b"%PDF-1.4 benchmark"), f"bench-{i}.pdf", "application/pdf"),
+                "user_id": user_id,
+                "document_type": "payslip",
+                "colleague_id": colleague_id,
+                "request_id": request_id,
+            },
+            content_type="multipart/form-data",
+        ).status_code
+
+    def bulk_complaints(client, i, rng):
+        return client.post(
+            "/complaints/bulk",
+            json=[
+                {
+                    "title": f"Bulk complaint {i}-{j}",
+                    "description": "Benchmark complaint " * 8,
+                    "category": rng.choice(CATEGORIES),
+                    "user_id": rng.choice(ids["users"]),
+                }
+                for j in range(args.bulk_size)
+            ],
+        ).status_code
+
+    api_endpoints = {
+        "GET /complaints": get(lambda rng: "/complaints"),
+        "GET /complaints?category": get(lambda rng: "/complaints?category=Payroll"),
+        "GET /user/<id>": get(lambda rng: f"/user/{rng.choice(ids['users'])}"),
+        "GET /analytics": get(lambda rng: "/analytics"),
+        "GET /document-requests/<id>": get(
+            lambda rng: f"/document-requests/{rng.choice(ids['users'])}"
+        ),
+        "GET /ticket/<id>": get(lambda rng: f"/ticket/{rng.choice(ids['tickets'][:100])}"),
+        "GET /ticket/<id> If-None-Match": poll(
+            lambda rng: f"/ticket/{rng.choice(ids['tickets'][:100])}"
+        ),
+        "GET /complaint/<id>": get(
+            lambda rng: f"/complaint/{rng.choice(ids['complaints'][:100])}"
+        ),
+        "POST /upload-document": upload,
+        "POST /complaints/bulk": bulk_complaints,
+    }
+
+    def send_message(client, i, rng):
+        client.emit(
+            "send_message",
+            json.dumps(
+                {
+                    "complaint_id": rng.choice(chat_complaints),
+                    "sender_id": rng.choice(ids["users"]),
+                    "message": f"Load message {i}",
+                }
+            ),
+        )
+        # Timed until the message_ack, which in write-behind mode only comes
+        # once the batch holding the message is stored
+        deadline = time.monotonic() + ACK_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            for event in client.get_received():
+                if event["name"] == "message_ack":
+                    ack = json.loads(event["args"][0])
+                    return 200 if ack["status"] == "stored" else 500
+            time.sleep(0.001)
+        return "no_ack"
+
+    def request_messages(client, i, rng):
+        client.emit("request_messages", rng.choice(chat_complaints))
+        received = client.get_received()
+        return 200 if any(event["name"] == "receive_messages" for event in received) else 500
+
+    chat_events = {
+        "socket send_message": send_message,
+        "socket request_messages": request_messages,
+        "GET /chat/<complaint_id>": get(lambda rng: f"/chat/{rng.choice(chat_complaints)}"),
+    }
+
+    report = {
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "workdir", "database_url")
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "endpoints": {},
+    }
+    for name, call in api_endpoints.items():
+        report["endpoints"][name] = run_load(
+            api.app.test_client, call, args.requests, args.concurrency, args.seed
+        )
+    for name, call in chat_events.items():
+        make_client = (
+            chat.app.test_client
+            if name.startswith("GET")
+            else lambda: chat.socketio.test_client(chat.app)
+        )
+        report["endpoints"][name] = run_load(
+            make_client, call, args.requests, args.concurrency, args.seed
+        )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Run from backend/: python -m benchmarks.startup --help
+
+# Executed in a fresh interpreter per run so nothing is already imported
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter() - started
+report = {{
+    "import_seconds": imported,
+    "boto3_loaded": "boto3" in sys.modules,
+    "langchain_loaded": "langchain" in sys.modules,
+    "first_use_seconds": {{}},
+}}
+from services.clients import CLIENTS
+for name in {clients!r}:
+    started = time.perf_counter()
+    CLIENTS.get(name)
+    report["first_use_seconds"][name] = time.perf_counter() - started
+print(json.dumps(report))
+"""
+
+CLIENTS_BY_MODULE = {
+    "api": ["s3", "dynamodb", "summarize_chain"],
+    "chat": ["s3", "dynamodb"],
+}
+
+
+def configure_environment(workdir):
+    os.makedirs(workdir, exist_ok=True)
+    # Real AWS clients are built (no calls are made) so their cost is measured
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ["SUMMARY_LLM"] = "extractive"
+    os.environ["ENCRYPTION_KEYRING"] = os.path.join(workdir, "keyring.json")
+    os.environ["ENCRYPTION_KEYRING_CREATE"] = "1"
+    # Never the DATABASE_URL from the shell or .env
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+
+
+def probe(module):
+    code = PROBE.format(module=module, clients=CLIENTS_BY_MODULE[module])
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    def milliseconds(values):
+        return {
+            "p50": round(statistics.median(values) * 1000, 1),
+            "min": round(min(values) * 1000, 1),
+            "max": round(max(values) * 1000, 1),
+        }
+
+    return {
+        "runs": len(runs),
+        "import_ms": milliseconds([run["import_seconds"] for run in runs]),
+        "boto3_loaded_at_import": any(run["boto3_loaded"] for run in runs),
+        "langchain_loaded_at_import": any(run["langchain_loaded"] for run in runs),
+        "first_use_ms": {
+            name: milliseconds([run["first_use_seconds"][name] for run in runs])
+            for name in runs[0]["first_use_seconds"]
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure cold import time of the API and chat servers"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument(
+        "--modules", nargs="+", default=list(CLIENTS_BY_MODULE), choices=CLIENTS_BY_MODULE
+    )
+    parser.add_argument("--workdir", help="directory for the database and keyring")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    configure_environment(args.workdir or tempfile.mkdtemp(prefix="digital-box-startup-"))
+    report = {"config": {"runs": args.runs}, "modules": {}}
+    for module in args.modules:
+        report["modules"][module] = summarize([probe(module) for _ in range(args.runs)])
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,44 @@
 from flask import Flask, jsonify, request
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
-import boto3
 import json
 from datetime import datetime
-import uuid
-import base64
 import os
 
+from chat_common import (
+    attachment_uploader,
+    message_payload,
+    message_store,
+    parse_history_request,
+    rooms,
+    write_buffer
+)
+from services.chat_history import generate_message_id, history_page_size
+from services.metrics import instrument_app
+from services.pubsub import DEFAULT_CHANNEL, create_client_manager
+from services.rooms import complaint_room
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*")
+# With CHAT_MESSAGE_QUEUE set, emits are relayed through the broker so
+# several chat workers can run behind one load balancer
+socketio = SocketIO(app, cors_allowed_origins="*", client_manager=create_client_manager(
+    os.getenv('CHAT_MESSAGE_QUEUE'), channel=os.getenv('CHAT_CHANNEL', DEFAULT_CHANNEL)
+))
+instrument_app(app, 'chat', slow_request_ms=float(os.getenv('SLOW_REQUEST_MS', 0)) or None)
 
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-)
-BUCKET_NAME = os.getenv("BUCKET_NAME")
+def store_message(item, on_stored=None):
+    if write_buffer is None:
+        message_store.put(item)
+        if on_stored:
+            on_stored(True)
+    else:
+        write_buffer.put(item, on_stored)
 
-dynamodb = boto3.resource(
-    "dynamodb",
-    region_name=os.getenv("AWS_REGION"),
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-)
-chat_table = dynamodb.Table(os.getenv("CHAT_TABLE"))
+def join_complaint(complaint_id):
+    room = complaint_room(complaint_id)
+    join_room(room)
+    return rooms.join(request.sid, room)
 
 @socketio.on('connect')
 def handle_connect():
@@ -33,8 +46,21 @@ def handle_connect():
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    rooms.leave_all(request.sid)
     print('Client disconnected')
 
+@socketio.on('join_complaint')
+def handle_join_complaint(complaint_id):
+    join_complaint(complaint_id)
+    emit('joined_complaint', complaint_id)
+
+@socketio.on('leave_complaint')
+def handle_leave_complaint(complaint_id):
+    room = complaint_room(complaint_id)
+    leave_room(room)
+    rooms.leave(request.sid, room)
+    emit('left_complaint', complaint_id)
+
 @socketio.on('send_message')
 def handle_send_message(data):
     message = json.loads(data)
@@ -42,64 +68,115 @@ def handle_send_message(data):
     sender_id = message['sender_id']
     message_text = message['message']
     timestamp = datetime.now().isoformat()
-    message_id = str(uuid.uuid4())
+    message_id = generate_message_id()
+    item = {
+        'complaint_id': complaint_id,
+        'message_id': message_id,
+        'sender_id': sender_id,
+        'message': message_text,
+        'timestamp': timestamp,
+        'attachment_url': None
+    }
 
     attachment = message.get('attachment')
-    attachment_url = None
     if attachment:
-        attachment_name = attachment['name']
-        attachment_bytes = base64.b64decode(attachment['bytes'])
-        s3_key = f"attachments/{complaint_id}/{message_id}/{attachment_name}"
-        s3.put_object(Body=attachment_bytes, Bucket=BUCKET_NAME, Key=s3_key)
-        attachment_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
+        item['attachment_name'] = attachment['name']
+        item['attachment_status'] = 'pending'
 
     # Store the message in DynamoDB
-    chat_table.put_item(
-        Item={
-            'complaint_id': complaint_id,
-            'message_id': message_id,
-            'sender_id': sender_id,
-            'message': message_text,
-            'timestamp': timestamp,
-            'attachment_url': attachment_url
-        }
-    )
+    sid = request.sid
+    store_message(item, lambda stored: socketio.emit('message_ack', json.dumps({
+        'complaint_id': complaint_id,
+        'message_id': message_id,
+        'status': 'stored' if stored else 'failed'
+    }), to=sid))
+
+    # Only clients following this complaint receive the message; the sender
+    # is joined implicitly so it still gets its own echo
+    join_complaint(complaint_id)
+    room = complaint_room(complaint_id)
+    rooms.record_message(room)
+    emit('receive_message', json.dumps(message_payload(item)), to=room)
+
+    # The upload runs on the attachment pool after the pending message is
+    # stored and delivered; an attachment_updated event follows once it lands
+    if attachment:
+        blob_key = f"attachments/{complaint_id}/{message_id}/{attachment['name']}"
+        queued = attachment_uploader.submit(
+            blob_key,
+            attachment['bytes'],
+            lambda attachment_url: finish_attachment(
+                item, attachment_url, 'uploaded' if attachment_url else 'failed'
+            )
+        )
+        if not queued:
+            finish_attachment(item, None, 'rejected')
 
-    # Emit the message to all connected clients
-    emit('receive_message', data, broadcast=True)
+def finish_attachment(item, attachment_url, attachment_status):
+    item = dict(item, attachment_url=attachment_url, attachment_status=attachment_status)
+    store_message(item)
+    socketio.emit('attachment_updated', json.dumps({
+        'complaint_id': item['complaint_id'],
+        'message_id': item['message_id'],
+        'attachment_url': attachment_url,
+        'attachment_status': attachment_status
+    }), to=complaint_room(item['complaint_id']))
 
 @socketio.on('request_messages')
-def handle_request_messages(complaint_id):
+def handle_request_messages(data):
+    history_request = parse_history_request(data)
+    complaint_id = history_request['complaint_id']
     print('Requesting messages for complaint ID:', complaint_id)
-    # Retrieve all chat messages for the complaint from DynamoDB
-    response = chat_table.query(
-        IndexName='complaint_id-message_id-index',
-        KeyConditionExpression='complaint_id = :complaint_id',
-        ExpressionAttributeValues={':complaint_id': complaint_id},
-        ScanIndexForward=True
+    # Opening a conversation subscribes the client to its live messages
+    join_complaint(complaint_id)
+    try:
+        limit = history_page_size(history_request.get('limit'))
+    except ValueError:
+        emit('error', json.dumps({'message': 'limit must be a positive integer'}))
+        return
+    messages, has_more = message_store.query(
+        complaint_id,
+        before=history_request.get('before'),
+        since=history_request.get('since'),
+        limit=limit
     )
-    messages = response['Items']
-    # Emit the messages to the requesting client
-    for message in messages:
-        emit('receive_message', json.dumps({
-            'complaint_id': message['complaint_id'],
-            'sender_id': message['sender_id'],
-            'message': message['message'],
-            'timestamp': message['timestamp'],
-            'attachment_url': message.get('attachment_url')
-        }))
+    forward = history_request.get('since') and not history_request.get('before')
+    # Emit the whole page to the requesting client in one event
+    emit('receive_messages', json.dumps({
+        'complaint_id': complaint_id,
+        'messages': [message_payload(message) for message in messages],
+        'next_before': messages[0]['message_id'] if messages and has_more and not forward else None,
+        'next_since': messages[-1]['message_id'] if messages and has_more and forward else None
+    }))
 
 @app.route('/chat/<complaint_id>')
 def get_chat_messages(complaint_id):
-    # Retrieve all chat messages for a specific complaint from DynamoDB
-    response = chat_table.query(
-        IndexName='complaint_id-message_id-index',
-        KeyConditionExpression='complaint_id = :complaint_id',
-        ExpressionAttributeValues={':complaint_id': complaint_id},
-        ScanIndexForward=True
+    try:
+        limit = history_page_size(request.args.get('limit'))
+    except ValueError:
+        return jsonify({'message': 'limit must be a positive integer'}), 400
+    before = request.args.get('before')
+    since = request.args.get('since')
+    messages, has_more = message_store.query(
+        complaint_id, before=before, since=since, limit=limit
     )
-    messages = response['Items']
-    return jsonify(messages)
+    response = jsonify(messages)
+    if messages and has_more:
+        if since and not before:
+            response.headers['X-Next-Since'] = messages[-1]['message_id']
+        else:
+            response.headers['X-Next-Before'] = messages[0]['message_id']
+    return response
+
+@app.route('/metrics/rooms')
+def get_room_metrics():
+    return jsonify(rooms.stats())
+
+@app.route('/metrics/writes')
+def get_write_metrics():
+    if write_buffer is None:
+        return jsonify({'mode': 'sync'})
+    return jsonify(dict(write_buffer.stats(), mode='write-behind'))
 
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=5001)
\ No newline at end of file
+    socketio.run(app, host='0.0.0.0', port=int(os.getenv('CHAT_PORT', 5001)))
\ No newline at end of file
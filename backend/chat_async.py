@@ -0,0 +1,227 @@
+import asyncio
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import socketio
+from aiohttp import web
+
+from chat_common import (
+    attachment_uploader,
+    message_payload,
+    message_store,
+    parse_history_request,
+    rooms,
+    write_buffer
+)
+from services.chat_history import generate_message_id, history_page_size
+from services.metrics import REGISTRY, REQUEST_SECONDS
+from services.pubsub import DEFAULT_CHANNEL, create_client_manager
+from services.rooms import complaint_room
+
+# Runs the chat server on asyncio: idle sockets cost a coroutine each instead
+# of a thread, and blocking storage calls are handed to a bounded pool.
+# Start with `python chat_async.py`.
+
+sio = socketio.AsyncServer(
+    client_manager=create_client_manager(
+        os.getenv('CHAT_MESSAGE_QUEUE'),
+        channel=os.getenv('CHAT_CHANNEL', DEFAULT_CHANNEL),
+        async_mode=True
+    ),
+    async_mode='aiohttp',
+    cors_allowed_origins='*',
+    ping_interval=int(os.getenv('CHAT_PING_INTERVAL', 25)),
+    ping_timeout=int(os.getenv('CHAT_PING_TIMEOUT', 20))
+)
+
+# Sized to the boto3 connection pool so storage calls never queue on it
+storage_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CHAT_STORAGE_WORKERS', 32)),
+    thread_name_prefix='chat-storage'
+)
+
+async def run_storage(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(storage_executor, functools.partial(fn, *args, **kwargs))
+
+def emit_threadsafe(loop, event, data, to):
+    # For callbacks fired on the write-behind and attachment upload threads
+    asyncio.run_coroutine_threadsafe(sio.emit(event, data, to=to), loop)
+
+async def store_message(item, on_stored=None):
+    if write_buffer is None:
+        await run_storage(message_store.put, item)
+        if on_stored:
+            on_stored(True)
+    else:
+        write_buffer.put(item, on_stored)
+
+async def join_complaint(sid, complaint_id):
+    room = complaint_room(complaint_id)
+    await sio.enter_room(sid, room)
+    return rooms.join(sid, room)
+
+@sio.event
+async def connect(sid, environ):
+    print('Client connected')
+
+@sio.event
+async def disconnect(sid, *args):
+    rooms.leave_all(sid)
+    print('Client disconnected')
+
+@sio.on('join_complaint')
+async def handle_join_complaint(sid, complaint_id):
+    await join_complaint(sid, complaint_id)
+    await sio.emit('joined_complaint', complaint_id, to=sid)
+
+@sio.on('leave_complaint')
+async def handle_leave_complaint(sid, complaint_id):
+    room = complaint_room(complaint_id)
+    await sio.leave_room(sid, room)
+    rooms.leave(sid, room)
+    await sio.emit('left_complaint', complaint_id, to=sid)
+
+@sio.on('send_message')
+async def handle_send_message(sid, data):
+    loop = asyncio.get_running_loop()
+    message = json.loads(data)
+    complaint_id = message['complaint_id']
+    message_id = generate_message_id()
+    item = {
+        'complaint_id': complaint_id,
+        'message_id': message_id,
+        'sender_id': message['sender_id'],
+        'message': message['message'],
+        'timestamp': datetime.now().isoformat(),
+        'attachment_url': None
+    }
+
+    attachment = message.get('attachment')
+    if attachment:
+        item['attachment_name'] = attachment['name']
+        item['attachment_status'] = 'pending'
+
+    await store_message(item, lambda stored: emit_threadsafe(loop, 'message_ack', json.dumps({
+        'complaint_id': complaint_id,
+        'message_id': message_id,
+        'status': 'stored' if stored else 'failed'
+    }), sid))
+
+    await join_complaint(sid, complaint_id)
+    room = complaint_room(complaint_id)
+    rooms.record_message(room)
+    await sio.emit('receive_message', json.dumps(message_payload(item)), to=room)
+
+    if attachment:
+        blob_key = f"attachments/{complaint_id}/{message_id}/{attachment['name']}"
+        queued = attachment_uploader.submit(
+            blob_key,
+            attachment['bytes'],
+            lambda attachment_url: asyncio.run_coroutine_threadsafe(finish_attachment(
+                item, attachment_url, 'uploaded' if attachment_url else 'failed'
+            ), loop)
+        )
+        if not queued:
+            await finish_attachment(item, None, 'rejected')
+
+async def finish_attachment(item, attachment_url, attachment_status):
+    item = dict(item, attachment_url=attachment_url, attachment_status=attachment_status)
+    await store_message(item)
+    await sio.emit('attachment_updated', json.dumps({
+        'complaint_id': item['complaint_id'],
+        'message_id': item['message_id'],
+        'attachment_url': attachment_url,
+        'attachment_status': attachment_status
+    }), to=complaint_room(item['complaint_id']))
+
+@sio.on('request_messages')
+async def handle_request_messages(sid, data):
+    history_request = parse_history_request(data)
+    complaint_id = history_request['complaint_id']
+    await join_complaint(sid, complaint_id)
+    try:
+        limit = history_page_size(history_request.get('limit'))
+    except ValueError:
+        await sio.emit('error', json.dumps({'message': 'limit must be a positive integer'}), to=sid)
+        return
+    messages, has_more = await run_storage(
+        message_store.query,
+        complaint_id,
+        before=history_request.get('before'),
+        since=history_request.get('since'),
+        limit=limit
+    )
+    forward = history_request.get('since') and not history_request.get('before')
+    await sio.emit('receive_messages', json.dumps({
+        'complaint_id': complaint_id,
+        'messages': [message_payload(message) for message in messages],
+        'next_before': messages[0]['message_id'] if messages and has_more and not forward else None,
+        'next_since': messages[-1]['message_id'] if messages and has_more and forward else None
+    }), to=sid)
+
+# ==============================HTTP routes========================================
+
+@web.middleware
+async def record_request(request, handler):
+    # Socket.IO long-polling and websocket requests are left to engineio
+    if request.path.startswith('/socket.io'):
+        return await handler(request)
+    started = time.perf_counter()
+    response = await handler(request)
+    route = request.match_info.route.resource
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        app='chat',
+        route=route.canonical if route else 'unmatched',
+        method=request.method,
+        status=response.status
+    )
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+async def get_chat_messages(request):
+    complaint_id = request.match_info['complaint_id']
+    try:
+        limit = history_page_size(request.query.get('limit'))
+    except ValueError:
+        return web.json_response({'message': 'limit must be a positive integer'}, status=400)
+    before = request.query.get('before')
+    since = request.query.get('since')
+    messages, has_more = await run_storage(
+        message_store.query, complaint_id, before=before, since=since, limit=limit
+    )
+    response = web.json_response(messages)
+    if messages and has_more:
+        if since and not before:
+            response.headers['X-Next-Since'] = messages[-1]['message_id']
+        else:
+            response.headers['X-Next-Before'] = messages[0]['message_id']
+    return response
+
+async def get_metrics(request):
+    return web.Response(
+        text=REGISTRY.render(), headers={'Content-Type': 'text/plain; version=0.0.4'}
+    )
+
+async def get_room_metrics(request):
+    return web.json_response(rooms.stats())
+
+async def get_write_metrics(request):
+    if write_buffer is None:
+        return web.json_response({'mode': 'sync'})
+    return web.json_response(dict(write_buffer.stats(), mode='write-behind'))
+
+web_app = web.Application(middlewares=[record_request])
+sio.attach(web_app)
+web_app.router.add_get('/chat/{complaint_id}', get_chat_messages)
+web_app.router.add_get('/metrics', get_metrics)
+web_app.router.add_get('/metrics/rooms', get_room_metrics)
+web_app.router.add_get('/metrics/writes', get_write_metrics)
+
+if __name__ == '__main__':
+    web.run_app(web_app, host='0.0.0.0', port=int(os.getenv('CHAT_PORT', 5001)))
@@ -0,0 +1,62 @@
+import json
+import os
+
+from services.attachments import AttachmentUploader
+from services.clients import CLIENTS
+from services.metrics import REGISTRY
+from services.rooms import RoomRegistry
+from services.write_behind import COUNTER_STATS, WriteBehindBuffer
+
+# State and helpers shared by chat.py and chat_async.py. Kept free of either
+# server so that importing it does not build a Socket.IO server or connect to
+# the message queue.
+
+blob_store = CLIENTS.lazy('blob_store')
+message_store = CLIENTS.lazy('message_store')
+REGISTRY.register_collector('digital_box_clients', CLIENTS.stats)
+
+attachment_uploader = AttachmentUploader(
+    blob_store,
+    max_workers=int(os.getenv("ATTACHMENT_UPLOAD_WORKERS", 4)),
+    max_pending=int(os.getenv("ATTACHMENT_UPLOAD_QUEUE", 64)),
+)
+
+# Write-behind mode trades per-message put_item round trips for batched
+# writes; senders get a message_ack once their batch is durable
+write_buffer = None
+if os.getenv('CHAT_WRITE_BEHIND') == '1':
+    write_buffer = WriteBehindBuffer(
+        lambda items: message_store.batch_put(items),
+        key=lambda item: item['message_id'],
+        max_batch=int(os.getenv('CHAT_WRITE_BATCH', 25)),
+        flush_interval=int(os.getenv('CHAT_WRITE_INTERVAL_MS', 50)) / 1000
+    )
+    REGISTRY.register_collector(
+        'digital_box_chat_writes', write_buffer.stats, counters=COUNTER_STATS
+    )
+
+rooms = RoomRegistry()
+REGISTRY.register_collector('digital_box_chat_rooms', rooms.stats)
+
+def message_payload(item):
+    return {
+        'complaint_id': item['complaint_id'],
+        'message_id': item['message_id'],
+        'sender_id': item['sender_id'],
+        'message': item['message'],
+        'timestamp': item['timestamp'],
+        'attachment_url': item.get('attachment_url'),
+        'attachment_status': item.get('attachment_status'),
+        'attachment': {'name': item['attachment_name']} if item.get('attachment_name') else None
+    }
+
+def parse_history_request(data):
+    # Older clients send the bare complaint id; newer ones send a JSON object
+    # with complaint_id and optional before/since/limit
+    if isinstance(data, str):
+        try:
+            request_data = json.loads(data)
+        except ValueError:
+            request_data = data
+        data = request_data if isinstance(request_data, dict) else {'complaint_id': data}
+    return data
@@ -13,36 +13,111 @@ class Collegue(db.Model):
     document_requests = db.relationship('Documentrequest', backref='collegue', lazy=True)
 
 class Complaints(db.Model):
+    __table_args__ = (
+        db.Index("ix_complaints_created_at_complaint_id", "created_at", "complaint_id"),
+        db.Index(
+            "ix_complaints_category_blind_index_created_at",
+            "category_blind_index",
+            "created_at",
+            "complaint_id",
+        ),
+        db.Index("ix_complaints_title_blind_index", "title_blind_index"),
+        db.Index("ix_complaints_user_id_created_at", "user_id", "created_at"),
+    )
+
     complaint_id = db.Column(db.String(120), primary_key=True)
     encrypted_data = db.Column(db.String(120), nullable=False)
     encryption_key = db.Column(db.String(120), nullable=False)
+    category_blind_index = db.Column(db.String(64))
+    title_blind_index = db.Column(db.String(64))
     user_id = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False)
     ticket = db.relationship('Ticket', backref='complaints',uselist=False, lazy=True)
-    created_at = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
 
 class Ticket(db.Model):
+    __table_args__ = (
+        db.Index("ix_ticket_status_complaint_id", "ticket_status", "complaint_id"),
+        # Copy of the complaint's created_at so open tickets page newest-first
+        # straight off this index
+        db.Index(
+            "ix_ticket_status_created_at", "ticket_status", "created_at", "complaint_id"
+        ),
+    )
+
     ticket_id = db.Column(db.String(120), primary_key=True)
     ticket_status = db.Column(db.String(120), nullable=False)
-    complaint_id = db.Column(db.String(120), db.ForeignKey('complaints.complaint_id'), nullable=False)
-    user_id = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False)
+    complaint_id = db.Column(db.String(120), db.ForeignKey('complaints.complaint_id'), nullable=False, index=True)
+    user_id = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    # Bumped on every status change; ORM updates check it and fail with
+    # StaleDataError instead of overwriting a concurrent change
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
 class Document(db.Model):
+    __table_args__ = (
+        db.Index(
+            "ix_document_requested_colleague_id_uploaded_at",
+            "requested_colleague_id",
+            "uploaded_at",
+            "document_id",
+        ),
+    )
+
     document_id = db.Column(db.String(120), primary_key=True)
-    user_id = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False, index=True)
     document_type = db.Column(db.String(120), nullable=False)
     filename = db.Column(db.String(120), nullable=False)
-    uploaded_at = db.Column(db.String(100), nullable=False)
+    uploaded_at = db.Column(db.DateTime, nullable=False)
     requested_colleague_id = db.Column(db.String(120), db.ForeignKey('collegue.id'), nullable=False)
-    document_request_id = db.Column(db.String(120), db.ForeignKey('documentrequest.request_id'), nullable=False)
-    presigned_url = db.Column(db.String(120), nullable=False)
+    document_request_id = db.Column(db.String(120), db.ForeignKey('documentrequest.request_id'), nullable=False, index=True)
+    # Content digest of the stored file; documents uploaded before content
+    # addressing have none and are stored under their filename
+    blob_digest = db.Column(db.String(64), db.ForeignKey('blob.digest'), index=True)
 
 class Documentrequest(db.Model):
+    __table_args__ = (
+        db.Index(
+            "ix_documentrequest_user_id_requested_at",
+            "user_id",
+            "requested_at",
+            "request_id",
+        ),
+        db.Index(
+            "ix_documentrequest_colleague_id_requested_at",
+            "colleague_id",
+            "requested_at",
+            "request_id",
+        ),
+    )
+
     request_id = db.Column(db.String(120), primary_key=True)
     user_id = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False)
     document_type = db.Column(db.String(120), nullable=False)
     colleague_id = db.Column(db.String(120), db.ForeignKey('collegue.id'), nullable=False)
-    requested_at = db.Column(db.String(100), nullable=False)
+    requested_at = db.Column(db.DateTime, nullable=False)
     document_purpose = db.Column(db.String(200), nullable=False)
     requested_dpt = db.Column(db.String(120), nullable=False)
 
+class Blob(db.Model):
+    digest = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(120))
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False)
+    # Set when the last reference goes; sweep_blobs deletes the row and the
+    # object once it is older than the grace period
+    released_at = db.Column(db.DateTime, index=True)
+
+class ComplaintRollup(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(120), primary_key=True)
+    ticket_status = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
 
+class ChatSummary(db.Model):
+    complaint_id = db.Column(db.String(120), db.ForeignKey('complaints.complaint_id'), primary_key=True)
+    last_message_id = db.Column(db.String(120), nullable=False)
+    summary = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
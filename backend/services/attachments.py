@@ -0,0 +1,39 @@
+import base64
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentUploader:
+    def __init__(self, blob_store, max_workers=4, max_pending=64):
+        self.blob_store = blob_store
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="attachment-upload"
+        )
+        # Caps decoded-but-not-yet-uploaded attachments held in memory
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, key, encoded_bytes, on_done):
+        # Returns False without queueing when the pipeline is saturated
+        if not self._slots.acquire(blocking=False):
+            return False
+        self._executor.submit(self._upload, key, encoded_bytes, on_done)
+        return True
+
+    def _upload(self, key, encoded_bytes, on_done):
+        try:
+            body = io.BytesIO(base64.b64decode(encoded_bytes))
+            self.blob_store.upload_fileobj(body, key)
+            url = self.blob_store.url_for(key)
+        except Exception:
+            logger.exception("Attachment upload failed: %s", key)
+            url = None
+        finally:
+            self._slots.release()
+        on_done(url)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,32 @@
+import hashlib
+import hmac
+import os
+
+NORMALIZERS = {
+    "category": lambda value: value.strip().casefold(),
+    "title": lambda value: value,
+}
+
+
+_configured_key = None
+
+
+def configure_blind_index_key(key):
+    global _configured_key
+    _configured_key = key
+
+
+def blind_index_key():
+    # Keyed so the stored digests can't be matched against a dictionary of
+    # likely categories or titles by anyone holding only the database. Every
+    # worker must use the same key, so there is no per-process fallback:
+    # BLIND_INDEX_KEY wins, otherwise the key stored in the keyring.
+    key = os.getenv("BLIND_INDEX_KEY") or _configured_key
+    if not key:
+        raise RuntimeError("No blind index key: set BLIND_INDEX_KEY or load the keyring")
+    return key.encode()
+
+
+def blind_index(field, value):
+    message = f"{field}:{NORMALIZERS[field](value)}".encode()
+    return hmac.new(blind_index_key(), message, hashlib.sha256).hexdigest()
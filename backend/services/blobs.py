@@ -0,0 +1,145 @@
+import datetime
+import hashlib
+
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
+
+from model import Blob, db
+from services.metrics import timed
+from services.storage import StorageError
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def blob_key(digest):
+    return f"sha256/{digest[:2]}/{digest}"
+
+
+def document_key(document):
+    return blob_key(document.blob_digest) if document.blob_digest else document.filename
+
+
+def hash_fileobj(fileobj):
+    # Reads the spooled upload in chunks and rewinds it for the upload
+    sha256 = hashlib.sha256()
+    size = 0
+    with timed("crypto", "sha256"):
+        for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            size += len(chunk)
+    fileobj.seek(0)
+    return sha256.hexdigest(), size
+
+
+def _add_reference(digest):
+    # Also revives a released blob the sweeper has not deleted yet: its row
+    # still exists, so the object does too
+    return Blob.query.filter_by(digest=digest).update(
+        {Blob.ref_count: Blob.ref_count + 1, Blob.released_at: None},
+        synchronize_session=False,
+    )
+
+
+def store_blob(blob_store, fileobj, content_type=None):
+    # Runs inside the caller's transaction, which must add the referencing
+    # row before committing. Returns (digest, size, uploaded).
+    digest, size = hash_fileobj(fileobj)
+    if _add_reference(digest):
+        return digest, size, False
+    key = blob_key(digest)
+    uploaded = False
+    if not blob_store.exists(key):
+        blob_store.upload_fileobj(fileobj, key, content_type=content_type)
+        uploaded = True
+    try:
+        with db.session.begin_nested():
+            db.session.add(
+                Blob(
+                    digest=digest,
+                    size=size,
+                    content_type=content_type,
+                    ref_count=1,
+                    created_at=datetime.datetime.now(),
+                )
+            )
+    except IntegrityError:
+        # The same content was stored concurrently
+        _add_reference(digest)
+    return digest, size, uploaded
+
+
+def abandon_blob(digest, size, content_type=None):
+    # For an object uploaded by store_blob whose transaction was rolled back:
+    # without a row sweep_blobs would never find it, so it is recorded as
+    # released. A row that already exists belongs to a concurrent upload of
+    # the same content, which now owns the object. Commits.
+    now = datetime.datetime.now()
+    try:
+        db.session.add(
+            Blob(
+                digest=digest,
+                size=size,
+                content_type=content_type,
+                ref_count=0,
+                created_at=now,
+                released_at=now,
+            )
+        )
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+
+
+def release_blob(digest):
+    # Drops one reference inside the caller's transaction. The object is left
+    # for sweep_blobs, so an upload of the same content can still reuse it.
+    Blob.query.filter_by(digest=digest).update(
+        {
+            Blob.ref_count: Blob.ref_count - 1,
+            Blob.released_at: case(
+                (Blob.ref_count <= 1, datetime.datetime.now()), else_=None
+            ),
+        },
+        synchronize_session=False,
+    )
+
+
+def sweep_blobs(blob_store, grace_seconds, batch_size=100, on_error=None):
+    # Deletes blobs released more than grace_seconds ago, each row together
+    # with its object. Returns (deleted, failed).
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=grace_seconds)
+    expired = (
+        Blob.ref_count <= 0,
+        Blob.released_at.is_not(None),
+        Blob.released_at < cutoff,
+    )
+    deleted = failed = 0
+    after = None
+    while True:
+        query = db.session.query(Blob.digest).filter(*expired)
+        if after:
+            query = query.filter(Blob.digest > after)
+        digests = [row.digest for row in query.order_by(Blob.digest).limit(batch_size)]
+        if not digests:
+            break
+        after = digests[-1]
+        for digest in digests:
+            # The row lock taken by the DELETE is held until the object is
+            # gone, so store_blob either revives the row first (and this
+            # matches nothing) or waits and then uploads the content again
+            if not Blob.query.filter(Blob.digest == digest, *expired).delete(
+                synchronize_session=False
+            ):
+                db.session.rollback()
+                continue
+            try:
+                blob_store.delete(blob_key(digest))
+            except StorageError as e:
+                db.session.rollback()
+                failed += 1
+                if on_error:
+                    on_error(digest, e)
+                continue
+            db.session.commit()
+            deleted += 1
+    return deleted, failed
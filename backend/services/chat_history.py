@@ -0,0 +1,59 @@
+import uuid
+from datetime import datetime
+
+CHAT_INDEX = "complaint_id-message_id-index"
+DEFAULT_HISTORY_PAGE = 50
+MAX_HISTORY_PAGE = 200
+
+
+def generate_message_id():
+    # message_id is the range key of the history index, so it has to sort in
+    # send order for before/since cursors to mean anything
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{uuid.uuid4().hex[:8]}"
+
+
+def history_page_size(value):
+    if value in (None, ""):
+        return DEFAULT_HISTORY_PAGE
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, MAX_HISTORY_PAGE)
+
+
+def query_messages(table, complaint_id, before=None, since=None, limit=None):
+    # Returns (messages oldest first, has_more). Without a limit every page is
+    # read. With `since` alone the page walks forward from the cursor; otherwise
+    # it holds the newest messages older than `before`.
+    from boto3.dynamodb.conditions import Key
+
+    condition = Key("complaint_id").eq(complaint_id)
+    if before and since:
+        condition &= Key("message_id").between(since, before)
+    elif before:
+        condition &= Key("message_id").lt(before)
+    elif since:
+        condition &= Key("message_id").gt(since)
+    newest_first = limit is not None and not (since and not before)
+    kwargs = {
+        "IndexName": CHAT_INDEX,
+        "KeyConditionExpression": condition,
+        "ScanIndexForward": not newest_first,
+    }
+    messages = []
+    while True:
+        if limit is not None:
+            kwargs["Limit"] = limit - len(messages)
+        response = table.query(**kwargs)
+        messages.extend(
+            item
+            for item in response["Items"]
+            if item["message_id"] not in (before, since)
+        )
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key or (limit is not None and len(messages) >= limit):
+            break
+        kwargs["ExclusiveStartKey"] = last_key
+    if newest_first:
+        messages.reverse()
+    return messages, bool(last_key)
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+from services.metrics import instrument_boto3
+from services.storage import create_blob_store, create_message_store
+
+
+class ClientRegistry:
+    # Builds each client on first use and shares it for the life of the process
+    def __init__(self):
+        self.factories = {}
+        self.instances = {}
+        self.init_seconds = {}
+        # Re-entrant because factories fetch the clients they depend on
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+
+    def get(self, name):
+        instance = self.instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self.instances.get(name)
+                if instance is None:
+                    started = time.perf_counter()
+                    instance = self.factories[name]()
+                    self.init_seconds[name] = time.perf_counter() - started
+                    self.instances[name] = instance
+        return instance
+
+    def lazy(self, name):
+        return LazyClient(self, name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                f"{name}_init_seconds": seconds
+                for name, seconds in self.init_seconds.items()
+            }
+
+
+class LazyClient:
+    # Stands in for a registry entry at import time
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(self._registry.get(self._name), attribute)
+
+
+def sqlalchemy_engine_options(database_url):
+    if database_url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 20)),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
+
+
+def _aws_config():
+    from botocore.config import Config
+
+    # Sized for the request threads plus the attachment upload pool sharing
+    # one client
+    return Config(
+        max_pool_connections=int(os.getenv("AWS_MAX_POOL_CONNECTIONS", 50)),
+        retries={"max_attempts": 3, "mode": "standard"},
+        tcp_keepalive=True,
+    )
+
+
+def _boto3_session():
+    import boto3
+
+    session = boto3.session.Session(
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=os.getenv("AWS_REGION"),
+    )
+    instrument_boto3(session)
+    return session
+
+
+def _summarize_chain():
+    from langchain.chains.summarize import load_summarize_chain
+
+    from services.summaries import make_llm
+
+    return load_summarize_chain(make_llm(), chain_type="map_reduce")
+
+
+CLIENTS = ClientRegistry()
+CLIENTS.register("boto3_session", _boto3_session)
+CLIENTS.register(
+    "s3", lambda: CLIENTS.get("boto3_session").client("s3", config=_aws_config())
+)
+CLIENTS.register(
+    "dynamodb",
+    lambda: CLIENTS.get("boto3_session").resource("dynamodb", config=_aws_config()),
+)
+CLIENTS.register("blob_store", lambda: create_blob_store(CLIENTS))
+CLIENTS.register("message_store", lambda: create_message_store(CLIENTS))
+CLIENTS.register("summarize_chain", _summarize_chain)
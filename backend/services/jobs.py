@@ -0,0 +1,109 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, key):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_queued=16, retain_seconds=600):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retain_seconds = retain_seconds
+        self.jobs = {}
+        self.in_flight = {}
+        # key -> the last job for it, if that job failed
+        self.failures = {}
+        self.rejected = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+
+    def submit(self, key, fn, *args):
+        # A job already queued or running for the same key is returned instead
+        # of starting another one
+        with self._lock:
+            self._expire()
+            job = self.in_flight.get(key)
+            if job is not None:
+                self.coalesced += 1
+                return job
+            if len(self.in_flight) >= self.max_workers + self.max_queued:
+                self.rejected += 1
+                raise JobQueueFull(key)
+            job = Job(key)
+            self.jobs[job.job_id] = job
+            self.in_flight[key] = job
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def recent_failure(self, key, within_seconds):
+        # Lets callers that poll by key back off instead of resubmitting a job
+        # that keeps failing
+        with self._lock:
+            job = self.failures.get(key)
+        if job is not None and job.finished_at > time.time() - within_seconds:
+            return job
+        return None
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self.in_flight.values() if job.status == "running")
+            return {
+                "running": running,
+                "queued": len(self.in_flight) - running,
+                "max_workers": self.max_workers,
+                "max_queued": self.max_queued,
+                "retained": len(self.jobs),
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+            }
+
+    def _run(self, job, fn, args):
+        job.status = "running"
+        try:
+            job.result = fn(*args)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        job.finished_at = time.time()
+        with self._lock:
+            self.in_flight.pop(job.key, None)
+            if job.status == "failed":
+                self.failures[job.key] = job
+            else:
+                self.failures.pop(job.key, None)
+        job.done.set()
+
+    def _expire(self):
+        cutoff = time.time() - self.retain_seconds
+        for job_id in [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]:
+            job = self.jobs.pop(job_id)
+            if self.failures.get(job.key) is job:
+                del self.failures[job.key]
@@ -0,0 +1,169 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import secrets
+
+from cryptography.fernet import Fernet, MultiFernet
+
+
+class KeyringError(Exception):
+    pass
+
+
+def key_id(key):
+    if isinstance(key, str):
+        key = key.encode()
+    return hashlib.blake2b(key, digest_size=8).hexdigest()
+
+
+def generate_blind_index_key():
+    return secrets.token_hex(32)
+
+
+class Keyring:
+    def __init__(self, keys, primary_id, blind_index_key=None):
+        self.keys = {key_id(key): key for key in keys}
+        if primary_id not in self.keys:
+            raise KeyringError(f"Primary key {primary_id} is not in the keyring")
+        self.primary_id = primary_id
+        # HMAC key for the blind indexes; never rotated with the Fernet keys,
+        # since every stored index would have to be recomputed
+        self.blind_index_key = blind_index_key
+        # MultiFernet encrypts with the first key and tries each in turn to decrypt
+        self.cipher = MultiFernet(
+            [Fernet(self.keys[primary_id])]
+            + [Fernet(key) for kid, key in self.keys.items() if kid != primary_id]
+        )
+
+    def key_ids(self):
+        return [self.primary_id] + [kid for kid in self.keys if kid != self.primary_id]
+
+    def to_json(self):
+        data = {"primary": self.primary_id, "keys": list(self.keys.values())}
+        if self.blind_index_key:
+            data["blind_index_key"] = self.blind_index_key
+        return data
+
+    def replace(self, keys=None, primary_id=None):
+        return Keyring(
+            self.keys.values() if keys is None else keys,
+            primary_id or self.primary_id,
+            self.blind_index_key,
+        )
+
+
+def _write_json(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def read_keyring(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        return Keyring(data["keys"], data["primary"], data.get("blind_index_key"))
+    except (OSError, ValueError, KeyError) as e:
+        raise KeyringError(f"Cannot read keyring {path}: {e}") from e
+
+
+def write_keyring(path, keyring):
+    # Replaced atomically so a starting worker never reads a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    _write_json(tmp_path, keyring.to_json())
+    os.replace(tmp_path, path)
+
+
+def create_keyring(path):
+    # Returns False if the keyring already exists. os.link fails if another
+    # worker created the keyring first, so all workers end up with the same key
+    if os.path.exists(path):
+        return False
+    key = Fernet.generate_key().decode()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    _write_json(
+        tmp_path,
+        {
+            "primary": key_id(key),
+            "keys": [key],
+            "blind_index_key": generate_blind_index_key(),
+        },
+    )
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        return False
+    finally:
+        os.unlink(tmp_path)
+    return True
+
+
+def load_keyring(path, create=False):
+    # A missing keyring is an error unless creating one is asked for: a fresh
+    # key could not decrypt anything already stored
+    if create:
+        create_keyring(path)
+    elif not os.path.exists(path):
+        raise KeyringError(
+            f"Keyring {path} does not exist; create it with "
+            "`python -m services.keyring init` or set ENCRYPTION_KEYRING_CREATE=1"
+        )
+    keyring = read_keyring(path)
+    if keyring.blind_index_key is None:
+        keyring = _add_blind_index_key(path)
+    return keyring
+
+
+def _add_blind_index_key(path):
+    # Keyrings written before blind indexes were keyed from them get one
+    # added; the lock makes every worker starting at once read the same key
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        keyring = read_keyring(path)
+        if keyring.blind_index_key is None:
+            keyring.blind_index_key = generate_blind_index_key()
+            write_keyring(path, keyring)
+    return keyring
+
+
+def add_key(path, primary=False):
+    keyring = read_keyring(path)
+    key = Fernet.generate_key().decode()
+    new_id = key_id(key)
+    keys = list(keyring.keys.values()) + [key]
+    write_keyring(path, keyring.replace(keys, new_id if primary else None))
+    return new_id
+
+
+def promote_key(path, new_primary_id):
+    keyring = read_keyring(path)
+    write_keyring(path, keyring.replace(primary_id=new_primary_id))
+
+
+def retire_keys(path, in_use):
+    # Drops every non-primary key no stored row still references
+    keyring = read_keyring(path)
+    retired = [
+        kid for kid in keyring.keys if kid != keyring.primary_id and kid not in in_use
+    ]
+    keys = [key for kid, key in keyring.keys.items() if kid not in retired]
+    write_keyring(path, keyring.replace(keys))
+    return retired
+
+
+if __name__ == "__main__":
+    # Run from backend/: python -m services.keyring init [--path keyring.json]
+    parser = argparse.ArgumentParser(
+        description="Create the complaint encryption keyring"
+    )
+    parser.add_argument("command", choices=["init"])
+    parser.add_argument(
+        "--path", default=os.getenv("ENCRYPTION_KEYRING", "keyring.json")
+    )
+    args = parser.parse_args()
+    if create_keyring(args.path):
+        print(f"Created keyring {args.path}")
+    else:
+        print(f"Keyring {args.path} already exists; left unchanged")
@@ -0,0 +1,277 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+# Time inside a request is attributed to one of these for the slow-request log
+DEPENDENCIES = ("sql", "crypto", "storage", "llm")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                    )
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}"
+                )
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, prefix, stats, counters=()):
+        # stats() returns a flat dict of numbers, exported as gauges except for
+        # the keys listed in counters
+        self.collectors.append((prefix, stats, frozenset(counters)))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, stats, counters in self.collectors:
+            for key, value in sorted(stats().items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                kind = "counter" if key in counters else "gauge"
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "digital_box_http_request_duration_seconds", "HTTP request latency by route"
+)
+REQUEST_SQL_QUERIES = REGISTRY.histogram(
+    "digital_box_http_request_sql_queries",
+    "SQL statements executed per HTTP request",
+    buckets=COUNT_BUCKETS,
+)
+DEPENDENCY_SECONDS = REGISTRY.histogram(
+    "digital_box_dependency_duration_seconds",
+    "Time spent in SQL, encryption, storage and LLM calls",
+)
+DEPENDENCY_ERRORS = REGISTRY.counter(
+    "digital_box_dependency_errors_total", "Failed SQL, storage and LLM calls"
+)
+
+
+def _record(dependency, operation, elapsed):
+    DEPENDENCY_SECONDS.observe(elapsed, dependency=dependency, operation=operation)
+    if has_request_context() and "breakdown" in g:
+        g.breakdown[dependency] += elapsed
+        if dependency == "sql":
+            g.sql_queries += 1
+
+
+@contextmanager
+def timed(dependency, operation):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        _record(dependency, operation, time.perf_counter() - started)
+
+
+class TimedCipher:
+    def __init__(self, cipher):
+        self.cipher = cipher
+
+    def encrypt(self, data):
+        with timed("crypto", "encrypt"):
+            return self.cipher.encrypt(data)
+
+    def decrypt(self, token, *args, **kwargs):
+        with timed("crypto", "decrypt"):
+            return self.cipher.decrypt(token, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cipher, name)
+
+
+# ==============================SQL and boto3 hooks========================================
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    words = statement.split(None, 1)
+    operation = words[0].lower() if words else "other"
+    _record("sql", operation, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_sql_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+    DEPENDENCY_ERRORS.inc(dependency="sql", operation="error")
+
+
+def _boto3_before_call(model, context, **kwargs):
+    # after-call-error is not passed the operation model, so keep its name here
+    context["metrics_operation"] = f"{model.service_model.service_name}.{model.name}"
+    context["metrics_started"] = time.perf_counter()
+
+
+def _boto3_after_call(context, **kwargs):
+    started = context.pop("metrics_started", None)
+    if started is not None:
+        operation = context["metrics_operation"]
+        _record("storage", operation, time.perf_counter() - started)
+        return operation
+
+
+def _boto3_after_call_error(context, **kwargs):
+    operation = _boto3_after_call(context)
+    if operation is not None:
+        DEPENDENCY_ERRORS.inc(dependency="storage", operation=operation)
+
+
+def instrument_boto3(session):
+    # Applies to every client created from the session afterwards
+    events = session.events
+    events.register("before-call", _boto3_before_call, unique_id="metrics-before-call")
+    events.register("after-call", _boto3_after_call, unique_id="metrics-after-call")
+    events.register(
+        "after-call-error", _boto3_after_call_error, unique_id="metrics-after-call-error"
+    )
+
+
+# ==============================Flask integration========================================
+
+
+def instrument_app(app, name, slow_request_ms=None):
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        g.breakdown = dict.fromkeys(DEPENDENCIES, 0.0)
+        g.sql_queries = 0
+
+    @app.after_request
+    def record_request(response):
+        if "request_started" not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(
+            elapsed,
+            app=name,
+            route=route,
+            method=request.method,
+            status=response.status_code,
+        )
+        REQUEST_SQL_QUERIES.observe(g.sql_queries, app=name, route=route)
+        if slow_request_ms is not None and elapsed * 1000 >= slow_request_ms:
+            breakdown = " ".join(
+                f"{dependency}={seconds * 1000:.1f}ms"
+                for dependency, seconds in g.breakdown.items()
+            )
+            app.logger.warning(
+                "Slow request %s %s %d %.1fms sql_queries=%d %s",
+                request.method,
+                request.full_path.rstrip("?"),
+                response.status_code,
+                elapsed * 1000,
+                g.sql_queries,
+                breakdown,
+            )
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
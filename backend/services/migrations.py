@@ -0,0 +1,272 @@
+import datetime
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    MetaData,
+    Table,
+    bindparam,
+    column,
+    inspect,
+    select,
+    table,
+    text,
+    update,
+)
+
+from model import Complaints, Ticket, db
+
+# (table, column, primary key) pairs that used to be stored as String(100)
+TIMESTAMP_COLUMNS = (
+    ("complaints", "created_at", "complaint_id"),
+    ("documentrequest", "requested_at", "request_id"),
+    ("document", "uploaded_at", "document_id"),
+)
+
+# Columns no longer in the models that would otherwise block inserts
+DROPPED_COLUMNS = (("document", "presigned_url"),)
+
+
+def parse_timestamp(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value)
+
+
+def _existing_columns(connection, table_name):
+    return {
+        existing["name"]: existing
+        for existing in inspect(connection).get_columns(table_name)
+    }
+
+
+def _add_column(connection, table_name, model_column):
+    column_type = model_column.type.compile(dialect=connection.dialect)
+    preparer = connection.dialect.identifier_preparer
+    statement = (
+        f"ALTER TABLE {preparer.quote(table_name)} "
+        f"ADD COLUMN {preparer.quote(model_column.name)} {column_type}"
+    )
+    if model_column.server_default is not None:
+        # A constant default fills existing rows without a separate backfill
+        statement += f" DEFAULT {model_column.server_default.arg}"
+    connection.execute(text(statement))
+
+
+def add_missing_columns():
+    # New columns are added as nullable so the ALTER does not rewrite the table
+    added = []
+    with db.engine.begin() as connection:
+        for model_table in db.metadata.sorted_tables:
+            if not inspect(connection).has_table(model_table.name):
+                continue
+            existing = _existing_columns(connection, model_table.name)
+            for model_column in model_table.columns:
+                if model_column.name not in existing:
+                    _add_column(connection, model_table.name, model_column)
+                    added.append(f"{model_table.name}.{model_column.name}")
+    return added
+
+
+def drop_removed_columns():
+    dropped = []
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        for table_name, column_name in DROPPED_COLUMNS:
+            if not inspect(connection).has_table(table_name):
+                continue
+            if column_name not in _existing_columns(connection, table_name):
+                continue
+            connection.execute(
+                text(
+                    f"ALTER TABLE {preparer.quote(table_name)} "
+                    f"DROP COLUMN {preparer.quote(column_name)}"
+                )
+            )
+            dropped.append(f"{table_name}.{column_name}")
+    return dropped
+
+
+def _copy_batch(connection, pending, copy):
+    rows = connection.execute(pending).all()
+    if rows:
+        connection.execute(
+            copy,
+            [{"row_key": key, "row_value": parse_timestamp(value)} for key, value in rows],
+        )
+    return len(rows)
+
+
+def restore_not_null(table_name, column_name):
+    # Columns added or swapped in by these migrations start out nullable.
+    # Returns whether the model's NOT NULL is now enforced by the database.
+    if db.metadata.tables[table_name].c[column_name].nullable:
+        return True
+    with db.engine.connect() as connection:
+        if not _existing_columns(connection, table_name)[column_name]["nullable"]:
+            return True
+    if db.engine.dialect.name != "postgresql":
+        # SQLite cannot change a column's nullability without rebuilding the
+        # table; the models still refuse to write NULL
+        return False
+    preparer = db.engine.dialect.identifier_preparer
+    quoted_table = preparer.quote(table_name)
+    quoted_column = preparer.quote(column_name)
+    check = preparer.quote(f"{table_name}_{column_name}_not_null")
+    # Validating a CHECK constraint scans the table without blocking writes,
+    # and SET NOT NULL then trusts it instead of scanning again under an
+    # exclusive lock
+    for statement in (
+        f"ALTER TABLE {quoted_table} ADD CONSTRAINT {check} "
+        f"CHECK ({quoted_column} IS NOT NULL) NOT VALID",
+        f"ALTER TABLE {quoted_table} VALIDATE CONSTRAINT {check}",
+        f"ALTER TABLE {quoted_table} ALTER COLUMN {quoted_column} SET NOT NULL",
+        f"ALTER TABLE {quoted_table} DROP CONSTRAINT {check}",
+    ):
+        with db.engine.begin() as connection:
+            connection.execute(text(statement))
+    return True
+
+
+def convert_timestamp_column(table_name, column_name, key_name, batch_size=500):
+    with db.engine.connect() as connection:
+        existing = _existing_columns(connection, table_name)
+    if isinstance(existing[column_name]["type"], DateTime):
+        return 0
+    # Expand: copy into a DateTime staging column one short transaction per
+    # batch, so readers and writers are never blocked for the whole table
+    staging_name = f"{column_name}_ts"
+    if staging_name not in existing:
+        with db.engine.begin() as connection:
+            _add_column(connection, table_name, Column(staging_name, DateTime))
+    rows_table = table(
+        table_name, column(key_name), column(column_name), column(staging_name, DateTime)
+    )
+    pending = (
+        select(rows_table.c[key_name], rows_table.c[column_name])
+        .where(rows_table.c[staging_name].is_(None))
+        .where(rows_table.c[column_name].is_not(None))
+        .limit(batch_size)
+    )
+    copy = (
+        update(rows_table)
+        .where(rows_table.c[key_name] == bindparam("row_key"))
+        .values({staging_name: bindparam("row_value")})
+    )
+    converted = 0
+    while True:
+        with db.engine.begin() as connection:
+            copied = _copy_batch(connection, pending, copy)
+        if not copied:
+            break
+        converted += copied
+    # Contract: swap the staging column in; indexes on the old column are
+    # recreated by create_missing_indexes
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # Writers wait from here until the swap commits, so no row can
+            # land in the old column after the final copy below
+            connection.execute(
+                text(f"LOCK TABLE {preparer.quote(table_name)} IN EXCLUSIVE MODE")
+            )
+        # Rows written since the last batch
+        while copied := _copy_batch(connection, pending, copy):
+            converted += copied
+        reflected = Table(table_name, MetaData(), autoload_with=connection)
+        for index in reflected.indexes:
+            if column_name in index.columns:
+                index.drop(connection)
+        connection.execute(
+            text(
+                f"ALTER TABLE {preparer.quote(table_name)} "
+                f"DROP COLUMN {preparer.quote(column_name)}"
+            )
+        )
+        connection.execute(
+            text(
+                f"ALTER TABLE {preparer.quote(table_name)} "
+                f"RENAME COLUMN {preparer.quote(staging_name)} "
+                f"TO {preparer.quote(column_name)}"
+            )
+        )
+    restore_not_null(table_name, column_name)
+    return converted
+
+
+def backfill_ticket_created_at(batch_size=500):
+    pending = (
+        select(Ticket.ticket_id, Complaints.created_at)
+        .join(Complaints, Complaints.complaint_id == Ticket.complaint_id)
+        .where(Ticket.created_at.is_(None))
+        .limit(batch_size)
+    )
+    copy = (
+        update(Ticket.__table__)
+        .where(Ticket.__table__.c.ticket_id == bindparam("row_key"))
+        .values(created_at=bindparam("row_value"))
+    )
+    backfilled = 0
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(pending).all()
+            if not rows:
+                break
+            connection.execute(
+                copy, [{"row_key": key, "row_value": value} for key, value in rows]
+            )
+        backfilled += len(rows)
+    restore_not_null("ticket", "created_at")
+    return backfilled
+
+
+def _invalid_indexes(connection):
+    # A CREATE INDEX CONCURRENTLY that failed leaves an invalid index behind
+    # under the same name
+    return set(
+        connection.execute(
+            text(
+                "SELECT index_class.relname FROM pg_index "
+                "JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid "
+                "WHERE NOT pg_index.indisvalid"
+            )
+        ).scalars()
+    )
+
+
+def create_missing_indexes():
+    # On Postgres indexes are built CONCURRENTLY, which does not block writes
+    # but cannot run inside a transaction
+    concurrently = db.engine.dialect.name == "postgresql"
+    preparer = db.engine.dialect.identifier_preparer
+    created = []
+    with db.engine.connect() as connection:
+        if concurrently:
+            connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+            invalid = _invalid_indexes(connection)
+        for model_table in db.metadata.sorted_tables:
+            existing = {
+                index["name"] for index in inspect(connection).get_indexes(model_table.name)
+            }
+            for index in model_table.indexes:
+                if concurrently and index.name in invalid:
+                    connection.execute(
+                        text(f"DROP INDEX CONCURRENTLY {preparer.quote(index.name)}")
+                    )
+                    existing.discard(index.name)
+                if index.name in existing:
+                    continue
+                if concurrently:
+                    # Set only for this statement; create_all() runs in a
+                    # transaction and must keep building indexes normally
+                    options = index.dialect_options["postgresql"]
+                    options["concurrently"] = True
+                    try:
+                        index.create(connection)
+                    finally:
+                        options["concurrently"] = False
+                else:
+                    index.create(connection)
+                    connection.commit()
+                created.append(index.name)
+    return created
@@ -0,0 +1,78 @@
+import base64
+import datetime
+import json
+
+from sqlalchemy import DateTime, and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def page_size(value):
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _json_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":"), default=_json_value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def _column_values(columns, values):
+    # DateTime keys travel as ISO 8601 strings and are compared as datetimes
+    try:
+        return [
+            datetime.datetime.fromisoformat(value)
+            if isinstance(column.type, DateTime)
+            else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def _seek_after(columns, values):
+    # Row-value comparison (a, b) < (x, y) spelled out so it works on every backend
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == values[j] for j in range(i)]
+        clauses.append(and_(*equal, column < values[i]))
+    return or_(*clauses)
+
+
+def keyset_page(query, columns, key, after=None, limit=DEFAULT_PAGE_SIZE):
+    # Newest-first page over `columns`; the last column must be unique so the
+    # order is total and a cursor never skips or repeats a row.
+    query = query.order_by(*[column.desc() for column in columns])
+    if after:
+        values = _column_values(columns, decode_cursor(after, len(columns)))
+        query = query.filter(_seek_after(columns, values))
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key(rows[-1]))
+    return rows, next_cursor
@@ -0,0 +1,37 @@
+from services.cache import PayloadCache
+from services.metrics import timed
+
+
+class PresignedUrls:
+    def __init__(
+        self, blob_store, expires_in=3600, refresh_margin=300, max_bytes=4 * 1024 * 1024
+    ):
+        self.blob_store = blob_store
+        self.expires_in = expires_in
+        # Entries leave the cache refresh_margin seconds before their
+        # signature expires, so every URL handed out stays valid at least
+        # that long
+        self.cache = PayloadCache(max_bytes, ttl_seconds=expires_in - refresh_margin)
+
+    def url_for(self, key):
+        return self.urls_for([key])[key]
+
+    def urls_for(self, keys):
+        urls = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            url = self.cache.get(key)
+            if url is None:
+                missing.append(key)
+            else:
+                urls[key] = url
+        if missing:
+            with timed("storage", "presign"):
+                signed = self.blob_store.presigned_urls(missing, self.expires_in)
+            for key, url in signed.items():
+                self.cache.put(key, url, len(url))
+            urls.update(signed)
+        return urls
+
+    def stats(self):
+        return self.cache.stats()
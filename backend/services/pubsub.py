@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+# Client managers relay Socket.IO emits between chat workers, so a message
+# reaches room members connected to any worker. Selected by URL:
+#   redis://, rediss://    Redis pub/sub (needs the redis package)
+#   amqp://                RabbitMQ (kombu, or aio_pika for the async server)
+#   kafka://               Kafka (threaded server only)
+#   relay://host:port      the line relay below, for development and benchmarks
+#   memory://              in-process stand-in, for servers sharing one process
+
+DEFAULT_CHANNEL = "digital-box-chat"
+
+
+# ==============================In-process stand-in========================================
+
+
+class LocalBroker:
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, deliver):
+        with self._lock:
+            self.subscribers[channel].append(deliver)
+
+    def publish(self, channel, message):
+        # Every subscriber gets the message, the publisher included, as with
+        # a real broker
+        with self._lock:
+            subscribers = list(self.subscribers[channel])
+        for deliver in subscribers:
+            deliver(message)
+
+
+LOCAL_BROKER = LocalBroker()
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    name = "memory"
+
+    def __init__(self, channel=DEFAULT_CHANNEL, write_only=False, logger=None, broker=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = broker or LOCAL_BROKER
+        self.queue = queue.Queue()
+        if not write_only:
+            self.broker.subscribe(channel, self.queue.put)
+
+    def _publish(self, data):
+        # Serialized like a real broker would, so unencodable payloads fail here too
+        self.broker.publish(self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield self.queue.get()
+
+
+class AsyncLocalPubSubManager(AsyncPubSubManager):
+    name = "memory"
+
+    def __init__(self, channel=DEFAULT_CHANNEL, write_only=False, logger=None, broker=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = broker or LOCAL_BROKER
+
+    async def _publish(self, data):
+        self.broker.publish(self.channel, self.json.dumps(data))
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        self.broker.subscribe(
+            self.channel, lambda message: loop.call_soon_threadsafe(messages.put_nowait, message)
+        )
+        while True:
+            yield await messages.get()
+
+
+# ==============================Line relay========================================
+
+# Each frame is one line, "<channel> <json>\n". The relay copies every line it
+# receives to every connection, the sender included, and keeps nothing.
+
+RELAY_RETRY_SECONDS = 1
+# A history page can be far longer than asyncio's default 64KiB line limit
+RELAY_LINE_LIMIT = 16 * 1024 * 1024
+
+
+def _relay_address(url):
+    parsed = urlparse(url)
+    return parsed.hostname or "127.0.0.1", parsed.port or 6390
+
+
+class RelayPubSubManager(socketio.PubSubManager):
+    name = "relay"
+
+    def __init__(self, url, channel=DEFAULT_CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.address = _relay_address(url)
+        self.prefix = f"{channel} ".encode()
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        with self._lock:
+            if self._sock is None:
+                self._sock = socket.create_connection(self.address)
+                self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return self._sock
+
+    def _reset(self, sock):
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+        sock.close()
+
+    def _publish(self, data):
+        line = self.prefix + self.json.dumps(data).encode() + b"\n"
+        sock = self._connection()
+        try:
+            with self._lock:
+                sock.sendall(line)
+        except OSError:
+            self._reset(sock)
+            raise
+
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connection()
+            except OSError as e:
+                self._get_logger().error("Cannot connect to relay %s: %s", self.address, e)
+                time.sleep(RELAY_RETRY_SECONDS)
+                continue
+            try:
+                for line in sock.makefile("rb"):
+                    if line.startswith(self.prefix):
+                        yield line[len(self.prefix) :]
+            except OSError as e:
+                self._get_logger().error("Lost relay connection: %s", e)
+            self._reset(sock)
+            time.sleep(RELAY_RETRY_SECONDS)
+
+
+class AsyncRelayPubSubManager(AsyncPubSubManager):
+    name = "relay"
+
+    def __init__(self, url, channel=DEFAULT_CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.address = _relay_address(url)
+        self.prefix = f"{channel} ".encode()
+        self._streams = None
+        self._lock = None
+
+    async def _connection(self):
+        # The lock has to be created on the server's event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._streams is None:
+                self._streams = await asyncio.open_connection(
+                    *self.address, limit=RELAY_LINE_LIMIT
+                )
+            return self._streams
+
+    async def _reset(self, streams):
+        if self._streams is streams:
+            self._streams = None
+        streams[1].close()
+
+    async def _publish(self, data):
+        streams = await self._connection()
+        streams[1].write(self.prefix + self.json.dumps(data).encode() + b"\n")
+        try:
+            await streams[1].drain()
+        except OSError:
+            await self._reset(streams)
+            raise
+
+    async def _listen(self):
+        while True:
+            try:
+                streams = await self._connection()
+            except OSError as e:
+                self._get_logger().error("Cannot connect to relay %s: %s", self.address, e)
+                await asyncio.sleep(RELAY_RETRY_SECONDS)
+                continue
+            try:
+                while line := await streams[0].readline():
+                    if line.startswith(self.prefix):
+                        yield line[len(self.prefix) :]
+            except OSError as e:
+                self._get_logger().error("Lost relay connection: %s", e)
+            await self._reset(streams)
+            await asyncio.sleep(RELAY_RETRY_SECONDS)
+
+
+async def serve_relay(host="127.0.0.1", port=6390):
+    peers = set()
+
+    async def handle(reader, writer):
+        peers.add(writer)
+        try:
+            while line := await reader.readline():
+                for peer in list(peers):
+                    peer.write(line)
+                # A reader that falls behind slows publishers rather than
+                # growing the relay's buffers without bound
+                for peer in list(peers):
+                    try:
+                        await peer.drain()
+                    except OSError:
+                        peers.discard(peer)
+        except OSError:
+            pass
+        finally:
+            peers.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, limit=RELAY_LINE_LIMIT)
+    async with server:
+        await server.serve_forever()
+
+
+def create_client_manager(url, channel=DEFAULT_CHANNEL, async_mode=False):
+    # None keeps the default single-process manager
+    if not url:
+        return None
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return AsyncLocalPubSubManager(channel) if async_mode else LocalPubSubManager(channel)
+    if scheme == "relay":
+        manager = AsyncRelayPubSubManager if async_mode else RelayPubSubManager
+        return manager(url, channel=channel)
+    if scheme in ("redis", "rediss"):
+        manager = socketio.AsyncRedisManager if async_mode else socketio.RedisManager
+        return manager(url, channel=channel)
+    if scheme in ("amqp", "amqps"):
+        manager = socketio.AsyncAioPikaManager if async_mode else socketio.KombuManager
+        return manager(url, channel=channel)
+    if scheme == "kafka" and not async_mode:
+        return socketio.KafkaManager(url, channel=channel)
+    raise ValueError(f"Unsupported chat message queue: {url}")
+
+
+if __name__ == "__main__":
+    # Run from backend/: python -m services.pubsub --port 6390
+    parser = argparse.ArgumentParser(description="Relay chat events between chat workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(serve_relay(args.host, args.port))
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from cryptography.fernet import InvalidToken
+from sqlalchemy import bindparam, or_, update
+
+from model import Complaints, db
+from services.metrics import timed
+
+
+class ReencryptionProgress:
+    def __init__(self):
+        self.status = "idle"
+        self.primary_id = None
+        self.total = 0
+        self.processed = 0
+        self.reencrypted = 0
+        self.failed = 0
+        self.last_complaint_id = None
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def start(self, primary_id, total):
+        with self._lock:
+            self.status = "running"
+            self.primary_id = primary_id
+            self.total = total
+            self.processed = self.reencrypted = self.failed = 0
+            self.last_complaint_id = None
+            self.started_at = time.time()
+            self.finished_at = None
+            self.error = None
+
+    def advance(self, processed, reencrypted, failed, last_complaint_id):
+        with self._lock:
+            self.processed += processed
+            self.reencrypted += reencrypted
+            self.failed += failed
+            self.last_complaint_id = last_complaint_id
+
+    def finish(self, status="done", error=None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            elapsed = 0
+            if self.started_at:
+                elapsed = (self.finished_at or time.time()) - self.started_at
+            return {
+                "status": self.status,
+                "primary_key": self.primary_id,
+                "total": self.total,
+                "processed": self.processed,
+                "reencrypted": self.reencrypted,
+                "failed": self.failed,
+                "remaining": max(self.total - self.processed, 0),
+                "last_complaint_id": self.last_complaint_id,
+                "rows_per_second": round(self.processed / elapsed, 1) if elapsed else 0,
+                "error": self.error,
+            }
+
+
+def reencrypt_complaints(
+    keyring, progress, batch_size=200, rows_per_second=None, after=None
+):
+    # Walks complaints not yet under the primary key in complaint_id order.
+    # Each batch commits on its own, so a restarted run resumes where the
+    # last one stopped; rows that fail to decrypt are counted and skipped.
+    stale = or_(
+        Complaints.encryption_key != keyring.primary_id,
+        Complaints.encryption_key.is_(None),
+    )
+    progress.start(keyring.primary_id, Complaints.query.filter(stale).count())
+    table = Complaints.__table__
+    # Only replaces a row whose ciphertext is still the one that was read
+    rewrite = (
+        update(table)
+        .where(table.c.complaint_id == bindparam("row_id"))
+        .where(table.c.encrypted_data == bindparam("old_data"))
+        .values(encrypted_data=bindparam("new_data"), encryption_key=keyring.primary_id)
+    )
+    try:
+        while True:
+            batch_started = time.monotonic()
+            query = db.session.query(Complaints.complaint_id, Complaints.encrypted_data)
+            query = query.filter(stale)
+            if after:
+                query = query.filter(Complaints.complaint_id > after)
+            rows = query.order_by(Complaints.complaint_id).limit(batch_size).all()
+            if not rows:
+                break
+            rewrites = []
+            failed = 0
+            with timed("crypto", "rotate"):
+                for complaint_id, encrypted_data in rows:
+                    try:
+                        new_data = keyring.cipher.rotate(encrypted_data.encode()).decode()
+                    except InvalidToken:
+                        failed += 1
+                        continue
+                    rewrites.append(
+                        {
+                            "row_id": complaint_id,
+                            "old_data": encrypted_data,
+                            "new_data": new_data,
+                        }
+                    )
+            if rewrites:
+                db.session.execute(rewrite, rewrites)
+            db.session.commit()
+            after = rows[-1].complaint_id
+            progress.advance(len(rows), len(rewrites), failed, after)
+            if rows_per_second:
+                # Keeps the job under its budget so live traffic keeps the database
+                pause = len(rows) / rows_per_second - (time.monotonic() - batch_started)
+                if pause > 0:
+                    time.sleep(pause)
+    except Exception as e:
+        db.session.rollback()
+        progress.finish("failed", error=str(e))
+        raise
+    progress.finish()
+    return progress.stats()
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import threading
+
+from services.cache import PayloadCache
+
+
+class ResourceCache:
+    # Read-through cache of serialized GET bodies and their ETags
+    def __init__(self, max_bytes, ttl_seconds):
+        self.cache = PayloadCache(max_bytes, ttl_seconds)
+        self.invalidations = 0
+        self.stale_fills = 0
+        self.not_modified = 0
+        # key -> [loads in flight, invalidated since they started]
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        # Returns (body, etag), or None when load() finds nothing; misses are
+        # not cached
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            loading = self._loading.setdefault(key, [0, False])
+            loading[0] += 1
+        entry = None
+        try:
+            payload = load()
+            if payload is not None:
+                body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+                entry = (body, hashlib.sha256(body).hexdigest()[:32])
+        finally:
+            # Filled under the same lock invalidate() takes, so a load that
+            # raced an invalidation and may have read the old row is served
+            # once but never cached
+            with self._lock:
+                loading[0] -= 1
+                if entry is not None:
+                    if loading[1]:
+                        self.stale_fills += 1
+                    else:
+                        self.cache.put(key, entry, len(entry[0]))
+                if not loading[0]:
+                    del self._loading[key]
+        return entry
+
+    def invalidate(self, key):
+        with self._lock:
+            self.invalidations += 1
+            if key in self._loading:
+                self._loading[key][1] = True
+            self.cache.invalidate(key)
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "invalidations": self.invalidations,
+                "stale_fills": self.stale_fills,
+                "not_modified": self.not_modified,
+            }
+        return dict(self.cache.stats(), **counters)
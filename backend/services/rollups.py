@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+from sqlalchemy.exc import IntegrityError
+
+from model import ComplaintRollup, Complaints, Ticket, db
+
+# Bucket for complaints whose category cannot be read, e.g. encrypted under a
+# key that has since been lost
+UNKNOWN_CATEGORY = "unknown"
+
+
+def bump_rollup(day, category, ticket_status, delta=1):
+    # Runs inside the caller's transaction so the counter moves together with
+    # the complaint or ticket row that caused it.
+    counter = ComplaintRollup.query.filter_by(
+        day=day, category=category, ticket_status=ticket_status
+    )
+    if counter.update(
+        {ComplaintRollup.count: ComplaintRollup.count + delta},
+        synchronize_session=False,
+    ):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(
+                ComplaintRollup(
+                    day=day, category=category, ticket_status=ticket_status, count=delta
+                )
+            )
+    except IntegrityError:
+        # Another transaction created the row first
+        counter.update(
+            {ComplaintRollup.count: ComplaintRollup.count + delta},
+            synchronize_session=False,
+        )
+
+
+def move_rollup(day, category, old_status, new_status, count=1):
+    if old_status == new_status:
+        return
+    bump_rollup(day, category, old_status, -count)
+    bump_rollup(day, category, new_status, count)
+
+
+def rebuild_rollups(category_of, chunk_size=1000):
+    counts = defaultdict(int)
+    rows = (
+        db.session.query(Complaints, Ticket.ticket_status)
+        .join(Ticket, Ticket.complaint_id == Complaints.complaint_id)
+        .yield_per(chunk_size)
+    )
+    for complaint, ticket_status in rows:
+        counts[(complaint.created_at.date(), category_of(complaint), ticket_status)] += 1
+    ComplaintRollup.query.delete()
+    db.session.add_all(
+        ComplaintRollup(day=day, category=category, ticket_status=status, count=count)
+        for (day, category, status), count in counts.items()
+    )
+    db.session.commit()
+    return len(counts)
@@ -0,0 +1,72 @@
+import threading
+from collections import defaultdict
+
+
+def complaint_room(complaint_id):
+    # Prefixed so a complaint id can never collide with a client's own sid room
+    return f"complaint:{complaint_id}"
+
+
+class RoomRegistry:
+    def __init__(self):
+        self.members = defaultdict(set)
+        self.rooms_by_client = defaultdict(set)
+        self.joins = 0
+        self.leaves = 0
+        self.messages = 0
+        self.deliveries = 0
+        self._lock = threading.Lock()
+
+    def join(self, sid, room):
+        with self._lock:
+            if sid in self.members[room]:
+                return False
+            self.members[room].add(sid)
+            self.rooms_by_client[sid].add(room)
+            self.joins += 1
+            return True
+
+    def leave(self, sid, room):
+        with self._lock:
+            if sid not in self.members.get(room, ()):
+                return False
+            self._discard(sid, room)
+            self.leaves += 1
+            return True
+
+    def leave_all(self, sid):
+        with self._lock:
+            rooms = self.rooms_by_client.pop(sid, set())
+            for room in rooms:
+                self._discard(sid, room)
+            self.leaves += len(rooms)
+            return rooms
+
+    def record_message(self, room):
+        with self._lock:
+            self.messages += 1
+            self.deliveries += len(self.members.get(room, ()))
+
+    def stats(self):
+        with self._lock:
+            sizes = [len(sids) for sids in self.members.values()]
+            return {
+                "rooms": len(sizes),
+                "members": sum(sizes),
+                "largest_room": max(sizes, default=0),
+                "clients": len(self.rooms_by_client),
+                "joins": self.joins,
+                "leaves": self.leaves,
+                "messages": self.messages,
+                "deliveries": self.deliveries,
+            }
+
+    def _discard(self, sid, room):
+        self.members[room].discard(sid)
+        if not self.members[room]:
+            del self.members[room]
+        rooms = self.rooms_by_client.get(sid)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self.rooms_by_client[sid]
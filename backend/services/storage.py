@@ -0,0 +1,239 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from services.chat_history import query_messages
+
+MB = 1024 * 1024
+
+
+class StorageError(Exception):
+    pass
+
+
+# ==============================Blob stores========================================
+
+
+class S3BlobStore:
+    def __init__(self, client, bucket, multipart_threshold=8 * MB):
+        self.client = client
+        self.bucket = bucket
+        from boto3.s3.transfer import TransferConfig
+
+        # upload_fileobj switches to a multipart upload above the threshold
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+        )
+
+    def upload_fileobj(self, fileobj, key, content_type=None):
+        extra_args = {"ContentType": content_type} if content_type else None
+        try:
+            self.client.upload_fileobj(
+                fileobj,
+                self.bucket,
+                key,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config,
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(str(e)) from e
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise StorageError(str(e)) from e
+        except BotoCoreError as e:
+            raise StorageError(str(e)) from e
+        return True
+
+    def delete(self, key):
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(str(e)) from e
+
+    def url_for(self, key):
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    def presigned_url(self, key, expires_in=3600):
+        return self.presigned_urls([key], expires_in)[key]
+
+    def presigned_urls(self, keys, expires_in=3600):
+        # Signing is local to the client, so a batch costs no round trips
+        try:
+            return {
+                key: self.client.generate_presigned_url(
+                    "get_object",
+                    Params={"Bucket": self.bucket, "Key": key},
+                    ExpiresIn=expires_in,
+                )
+                for key in keys
+            }
+        except (BotoCoreError, ClientError) as e:
+            raise StorageError(str(e)) from e
+
+
+class LocalBlobStore:
+    def __init__(self, root, base_url=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url or self.root.resolve().as_uri()
+
+    def _path(self, key):
+        path = (self.root / key).resolve()
+        if self.root.resolve() not in path.parents:
+            raise StorageError(f"Invalid key: {key}")
+        return path
+
+    def upload_fileobj(self, fileobj, key, content_type=None):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as out:
+                shutil.copyfileobj(fileobj, out)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def exists(self, key):
+        return self._path(key).is_file()
+
+    def delete(self, key):
+        try:
+            self._path(key).unlink(missing_ok=True)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def url_for(self, key):
+        return f"{self.base_url}/{key}"
+
+    def presigned_url(self, key, expires_in=3600):
+        return self.url_for(key)
+
+    def presigned_urls(self, keys, expires_in=3600):
+        return {key: self.url_for(key) for key in keys}
+
+
+# ==============================Message stores========================================
+
+
+DYNAMO_BATCH_LIMIT = 25
+
+
+class DynamoMessageStore:
+    def __init__(self, resource, table_name):
+        self.resource = resource
+        self.table = resource.Table(table_name)
+
+    def put(self, item):
+        self.table.put_item(Item=item)
+
+    def batch_put(self, items):
+        # Returns the items DynamoDB left unprocessed. batch_write_item takes
+        # at most 25 requests, so larger batches go out in several calls.
+        unprocessed = []
+        for start in range(0, len(items), DYNAMO_BATCH_LIMIT):
+            chunk = items[start : start + DYNAMO_BATCH_LIMIT]
+            response = self.resource.batch_write_item(
+                RequestItems={
+                    self.table.name: [{"PutRequest": {"Item": item}} for item in chunk]
+                }
+            )
+            unprocessed += response.get("UnprocessedItems", {}).get(self.table.name, [])
+        return [request["PutRequest"]["Item"] for request in unprocessed]
+
+    def query(self, complaint_id, before=None, since=None, limit=None):
+        return query_messages(
+            self.table, complaint_id, before=before, since=since, limit=limit
+        )
+
+
+class SQLiteMessageStore:
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_messages ("
+                "complaint_id TEXT NOT NULL, message_id TEXT NOT NULL, item TEXT NOT NULL, "
+                "PRIMARY KEY (complaint_id, message_id))"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def put(self, item):
+        self.batch_put([item])
+
+    def batch_put(self, items):
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chat_messages (complaint_id, message_id, item) "
+                "VALUES (?, ?, ?)",
+                [
+                    (item["complaint_id"], item["message_id"], json.dumps(item))
+                    for item in items
+                ],
+            )
+        return []
+
+    def query(self, complaint_id, before=None, since=None, limit=None):
+        # Same contract as chat_history.query_messages
+        clauses = ["complaint_id = ?"]
+        params = [complaint_id]
+        if before:
+            clauses.append("message_id < ?")
+            params.append(before)
+        if since:
+            clauses.append("message_id > ?")
+            params.append(since)
+        newest_first = limit is not None and not (since and not before)
+        sql = (
+            f"SELECT item FROM chat_messages WHERE {' AND '.join(clauses)} "
+            f"ORDER BY message_id {'DESC' if newest_first else 'ASC'}"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        rows = self._connection().execute(sql, params).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        messages = [json.loads(row[0]) for row in rows[:limit]]
+        if newest_first:
+            messages.reverse()
+        return messages, has_more
+
+
+# ==============================Factories========================================
+
+
+def local_storage_dir():
+    return Path(os.getenv("LOCAL_STORAGE_DIR", "local_storage"))
+
+
+def create_blob_store(clients):
+    if os.getenv("STORAGE_BACKEND", "aws") == "local":
+        return LocalBlobStore(
+            local_storage_dir() / "blobs", base_url=os.getenv("LOCAL_BLOB_URL")
+        )
+    return S3BlobStore(clients.get("s3"), os.getenv("BUCKET_NAME"))
+
+
+def create_message_store(clients):
+    if os.getenv("STORAGE_BACKEND", "aws") == "local":
+        local_storage_dir().mkdir(parents=True, exist_ok=True)
+        return SQLiteMessageStore(local_storage_dir() / "chat.sqlite3")
+    return DynamoMessageStore(clients.get("dynamodb"), os.getenv("CHAT_TABLE"))
@@ -0,0 +1,55 @@
+import datetime
+import os
+
+from model import ChatSummary, db
+from services.metrics import timed
+
+
+def make_llm():
+    if os.getenv("SUMMARY_LLM", "openai") == "extractive":
+        from services.extractive_llm import ExtractiveLLM
+
+        return ExtractiveLLM()
+    from langchain import OpenAI
+
+    return OpenAI(openai_api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def current_summary(message_store, complaint_id):
+    # The stored summary if no message has arrived since it was written
+    cached = db.session.get(ChatSummary, complaint_id)
+    since = cached.last_message_id if cached else None
+    newer, _ = message_store.query(complaint_id, since=since, limit=1)
+    if newer:
+        return None
+    return cached.summary if cached else ""
+
+
+def summarize_chat(chain, message_store, complaint_id):
+    # Only messages after the last summarized one are read and folded into the
+    # previous summary, so an unchanged conversation costs no LLM calls
+    cached = db.session.get(ChatSummary, complaint_id)
+    since = cached.last_message_id if cached else None
+    messages, _ = message_store.query(complaint_id, since=since)
+    if not messages:
+        return cached.summary if cached else ""
+    from langchain.docstore.document import Document as docstore_Document
+
+    documents = [docstore_Document(page_content=message["message"]) for message in messages]
+    if cached:
+        documents.insert(
+            0,
+            docstore_Document(
+                page_content=f"Summary of the conversation so far: {cached.summary}"
+            ),
+        )
+    with timed("llm", "summarize"):
+        summary = chain.run(documents)
+    if cached is None:
+        cached = ChatSummary(complaint_id=complaint_id)
+        db.session.add(cached)
+    cached.last_message_id = messages[-1]["message_id"]
+    cached.summary = summary
+    cached.updated_at = datetime.datetime.now()
+    db.session.commit()
+    return summary
@@ -0,0 +1,113 @@
+from collections import defaultdict
+
+from sqlalchemy import and_, case, update
+
+from model import Complaints, Ticket, db
+from services.rollups import move_rollup
+
+# Status -> statuses a ticket may move to from it. "closed" is what the
+# colleague app sets when it closes a ticket from the chat screen.
+TICKET_TRANSITIONS = {
+    "open": ("in_progress", "closed"),
+    "in_progress": ("resolved", "closed"),
+}
+TICKET_STATUSES = ("open", "in_progress", "resolved", "closed")
+
+
+def allowed_targets(ticket_status):
+    return TICKET_TRANSITIONS.get(ticket_status, ())
+
+
+def allowed_sources(ticket_status):
+    return [
+        source for source, targets in TICKET_TRANSITIONS.items() if ticket_status in targets
+    ]
+
+
+def transition_tickets(requested, ticket_status, category_of):
+    # requested maps ticket_id -> expected version (None to accept the version
+    # read here). Returns (updated, skipped) lists of dicts.
+    rows = (
+        db.session.query(Ticket.ticket_id, Ticket.ticket_status, Ticket.version, Complaints)
+        .join(Complaints, Complaints.complaint_id == Ticket.complaint_id)
+        .filter(Ticket.ticket_id.in_(requested))
+        .all()
+    )
+    found = {row.ticket_id: row for row in rows}
+    sources = allowed_sources(ticket_status)
+    skipped = []
+    expected = {}
+    for ticket_id, version in requested.items():
+        row = found.get(ticket_id)
+        if row is None:
+            skipped.append({"ticket_id": ticket_id, "reason": "not_found"})
+        elif row.ticket_status not in sources:
+            skipped.append(
+                {
+                    "ticket_id": ticket_id,
+                    "reason": "invalid_transition",
+                    "ticket_status": row.ticket_status,
+                    "version": row.version,
+                }
+            )
+        elif version is not None and version != row.version:
+            skipped.append(
+                {
+                    "ticket_id": ticket_id,
+                    "reason": "conflict",
+                    "ticket_status": row.ticket_status,
+                    "version": row.version,
+                }
+            )
+        else:
+            expected[ticket_id] = row.version
+    if not expected:
+        return [], skipped
+    # One guarded UPDATE: a ticket changed by anyone since it was read above
+    # no longer matches its expected version and is reported as a conflict
+    guard = and_(
+        Ticket.ticket_id.in_(expected),
+        Ticket.ticket_status.in_(sources),
+        Ticket.version == case(expected, value=Ticket.ticket_id),
+    )
+    statement = (
+        update(Ticket)
+        .where(guard)
+        .values(ticket_status=ticket_status, version=Ticket.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if db.engine.dialect.update_returning:
+        result = db.session.execute(statement.returning(Ticket.ticket_id, Ticket.version))
+        versions = dict(result.all())
+    else:
+        versions = {}
+        for ticket_id, version in expected.items():
+            result = db.session.execute(
+                statement.where(Ticket.ticket_id == ticket_id)
+            )
+            if result.rowcount:
+                versions[ticket_id] = version + 1
+    updated = []
+    # Tickets from the same day, category and status share one pair of
+    # counter updates
+    moves = defaultdict(int)
+    for ticket_id in expected:
+        row = found[ticket_id]
+        if ticket_id not in versions:
+            skipped.append({"ticket_id": ticket_id, "reason": "conflict"})
+            continue
+        complaint = row.Complaints
+        moves[
+            (complaint.created_at.date(), category_of(complaint), row.ticket_status)
+        ] += 1
+        updated.append(
+            {
+                "ticket_id": ticket_id,
+                "ticket_status": ticket_status,
+                "version": versions[ticket_id],
+            }
+        )
+    for (day, category, old_status), count in moves.items():
+        move_rollup(day, category, old_status, ticket_status, count)
+    db.session.commit()
+    return updated, skipped
@@ -0,0 +1,135 @@
+import atexit
+import bisect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25)
+# stats() keys that only ever grow, for exporting as counters
+COUNTER_STATS = (
+    "flushes",
+    "items_written",
+    "items_failed",
+    "retries",
+    "flush_seconds_total",
+) + tuple(f"batch_size_le_{bound}" for bound in BATCH_SIZE_BUCKETS)
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        write_batch,
+        key,
+        max_batch=25,
+        flush_interval=0.05,
+        max_retries=5,
+        retry_backoff=0.05,
+    ):
+        # write_batch(items) stores a batch and returns the items it could not
+        # process, like DynamoDB's UnprocessedItems
+        self.write_batch = write_batch
+        self.key = key
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.flushes = 0
+        self.items_written = 0
+        self.items_failed = 0
+        self.retries = 0
+        # One count per bucket, plus one for batches above the largest
+        self.batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self._pending = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, item, on_flushed=None):
+        with self._cond:
+            self._pending.append((item, on_flushed))
+            # The first item starts the flush interval; a full batch ends it
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+                "items_written": self.items_written,
+                "items_failed": self.items_failed,
+                "retries": self.retries,
+                "flush_seconds_total": self.flush_seconds_total,
+                "flush_seconds_max": self.flush_seconds_max,
+            }
+            # Cumulative, like histogram buckets: batch_size_le_5 counts every
+            # flush of at most 5 items
+            cumulative = 0
+            for bound, count in zip(BATCH_SIZE_BUCKETS, self.batch_sizes):
+                cumulative += count
+                stats[f"batch_size_le_{bound}"] = cumulative
+            return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._pending and len(self._pending) < self.max_batch and not self._closed:
+                    # Give a burst the flush interval to fill the batch
+                    self._cond.wait(self.flush_interval)
+                if not self._pending and self._closed:
+                    return
+                batch = self._pending[: self.max_batch]
+                del self._pending[: self.max_batch]
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        # A batch may not name the same key twice; the later write wins and
+        # both callers are acknowledged by it
+        items = {}
+        callbacks = {}
+        for item, on_flushed in batch:
+            key = self.key(item)
+            items[key] = item
+            callbacks.setdefault(key, []).append(on_flushed)
+        remaining = list(items.values())
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                remaining = self.write_batch(remaining)
+            except Exception:
+                logger.exception("Batch write of %d items failed", len(remaining))
+            if not remaining:
+                break
+        failed = {self.key(item) for item in remaining}
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self.flushes += 1
+            self.items_written += len(items) - len(failed)
+            self.items_failed += len(failed)
+            self.batch_sizes[bisect.bisect_left(BATCH_SIZE_BUCKETS, len(items))] += 1
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+        for key, key_callbacks in callbacks.items():
+            for on_flushed in key_callbacks:
+                if on_flushed is not None:
+                    on_flushed(key not in failed)
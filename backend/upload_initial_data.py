@@ -1,4 +1,4 @@
-from app import app
+from api import app
 from model import db
 
 with app.app_context():
@@ -27,10 +27,14 @@ class ChatScreen extends StatefulWidget {
 }
 
 class _ChatScreenState extends State<ChatScreen> with SingleTickerProviderStateMixin {
+  // Polls of a queued summary job, one second apart, before giving up
+  static const _summaryPollAttempts = 120;
+
   late IO.Socket socket;
   final TextEditingController _messageController = TextEditingController();
   final List<Map<String, dynamic>> _messages = [];
   String _summary = '';
+  String? _nextBefore;
   bool _isLoading = false;
   late AnimationController _animationController;
   late Animation<double> _buttonAnimation;
@@ -86,6 +90,8 @@ class _ChatScreenState extends State<ChatScreen> with SingleTickerProviderStateM
     socket = IO.io(dotenv.env['SOCKET_URL']!);
     socket.on('connect', (_) {
       print('Connected to server');
+      // Room membership doesn't survive a reconnect, so (re)join on every connect
+      socket.emit('join_complaint', widget.complaintId);
     });
 
     socket.on('receive_message', (data) {
@@ -96,6 +102,31 @@ class _ChatScreenState extends State<ChatScreen> with SingleTickerProviderStateM
         _messages.add(message);
       });
     });
+
+    socket.on('attachment_updated', (data) {
+      Map<String, dynamic> update = json.decode(data);
+      setState(() {
+        for (Map<String, dynamic> message in _messages) {
+          if (message['message_id'] == update['message_id']) {
+            message['attachment_url'] = update['attachment_url'];
+            message['attachment_status'] = update['attachment_status'];
+          }
+        }
+      });
+    });
+
+    socket.on('receive_messages', (data) {
+      Map<String, dynamic> page = json.decode(data);
+      List<dynamic> messages = page['messages'];
+      setState(() {
+        // Pages arrive oldest first and are always older than what is shown
+        for (int i = 0; i < messages.length; i++) {
+          _messages.insert(i, Map<String, dynamic>.from(messages[i]));
+          _listKey.currentState?.insertItem(i, duration: Duration(milliseconds: 500));
+        }
+        _nextBefore = page['next_before'];
+      });
+    });
   }
 
   void _generateSummary() async {
@@ -104,10 +135,30 @@ class _ChatScreenState extends State<ChatScreen> with SingleTickerProviderStateM
     });
 
     try {
-      final response = await http.get(
+      var response = await http.get(
         Uri.parse('${dotenv.env['API_URL']}/summarize/${widget.complaintId}'),
       );
 
+      // Summaries that need LLM work are queued as jobs; the Location header
+      // answers 202 until the summary is stored, from any API server
+      if (response.statusCode == 202) {
+        final summaryUrl = '${dotenv.env['API_URL']}${response.headers['location']}';
+        for (var attempt = 0; ; attempt++) {
+          if (attempt == _summaryPollAttempts) {
+            response = http.Response(response.body, 504);
+            break;
+          }
+          await Future.delayed(Duration(seconds: 1));
+          // Stop polling once the screen has been closed
+          if (!mounted) return;
+          response = await http.get(Uri.parse(summaryUrl));
+          if (response.statusCode != 202 && response.statusCode != 429) {
+            break;
+          }
+        }
+      }
+
+      if (!mounted) return;
       if (response.statusCode == 200) {
         final data = json.decode(response.body);
         setState(() {
@@ -122,6 +173,7 @@ class _ChatScreenState extends State<ChatScreen> with SingleTickerProviderStateM
       }
     } catch (e) {
       print('Error generating summary: $e');
+      if (!mounted) return;
       setState(() {
         _isLoading = false;
       });
@@ -132,6 +184,19 @@ class _ChatScreenState extends State<ChatScreen> with SingleTickerProviderStateM
     socket.emit('request_messages', widget.complaintId);
   }
 
+  void _fetchOlderMessages() {
+    if (_nextBefore == null) {
+      return;
+    }
+    socket.emit('request_messages', json.encode({
+      'complaint_id': widget.complaintId,
+      'before': _nextBefore,
+    }));
+    setState(() {
+      _nextBefore = null;
+    });
+  }
+
   void _sendMessage() {
     String messageText = _messageController.text.trim();
     if (messageText.isNotEmpty) {
@@ -317,6 +382,11 @@ class _ChatScreenState extends State<ChatScreen> with SingleTickerProviderStateM
               ],
             ),
           ),
+          if (_nextBefore != null)
+            TextButton(
+              onPressed: _fetchOlderMessages,
+              child: Text('Load earlier messages'),
+            ),
           Expanded(
             child: AnimatedList(
               key: _listKey,
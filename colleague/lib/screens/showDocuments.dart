@@ -14,6 +14,8 @@ class DocumentScreen extends StatefulWidget {
 }
 
 class _DocumentScreenState extends State<DocumentScreen> {
+  static const _pageSize = 500;
+
   List<Document> _documents = [];
 
   @override
@@ -26,37 +28,49 @@ class _DocumentScreenState extends State<DocumentScreen> {
     try {
       String userId = await fetchCurrentUserId();
       final apiUrl = dotenv.env['API_URL'];
-      final response = await http.get(
-        Uri.parse('$apiUrl/upload-document/$userId'),
-      );
+      final documents = <Document>[];
+      String? cursor;
+      // The API returns one page at a time and names the next one in the
+      // X-Next-Cursor header
+      do {
+        final response = await http.get(
+          Uri.parse('$apiUrl/upload-document/$userId').replace(queryParameters: {
+            'limit': '$_pageSize',
+            if (cursor != null) 'after': cursor,
+          }),
+        );
 
-      if (response.statusCode == 200) {
+        if (response.statusCode != 200) {
+          showDialog(
+            context: context,
+            builder: (BuildContext context) {
+              return AlertDialog(
+                title: Text('Error'),
+                content: Text(
+                    'Failed to fetch documents. Please try again later.'),
+                actions: [
+                  TextButton(
+                    onPressed: () {
+                      Navigator.of(context).pop();
+                    },
+                    child: Text('OK'),
+                  ),
+                ],
+              );
+            },
+          );
+          return;
+        }
         final List<dynamic> documentsData = json.decode(response.body);
-        final documents =
-        documentsData.map((data) => Document.fromJson(data)).toList();
-        setState(() {
-          _documents = documents;
-        });
-      } else {
-        showDialog(
-          context: context,
-          builder: (BuildContext context) {
-            return AlertDialog(
-              title: Text('Error'),
-              content: Text(
-                  'Failed to fetch documents. Please try again later.'),
-              actions: [
-                TextButton(
-                  onPressed: () {
-                    Navigator.of(context).pop();
-                  },
-                  child: Text('OK'),
-                ),
-              ],
-            );
-          },
-        );
-      }
+        documents.addAll(
+            documentsData.map((data) => Document.fromJson(data)));
+        cursor = response.headers['x-next-cursor'];
+      } while (cursor != null);
+
+      if (!mounted) return;
+      setState(() {
+        _documents = documents;
+      });
     } catch (e) {
       showDialog(
         context: context,